@@ -21,6 +21,7 @@ from app.models.user import User
 from app.models.social_account import SocialAccount
 from app.models.post import Post
 from app.models.statistics import Statistics
+from app.models.delivery import Delivery
 
 target_metadata = Base.metadata
 
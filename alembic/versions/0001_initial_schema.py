@@ -0,0 +1,104 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Базы, созданные до появления миграций, уже содержат эти таблицы —
+    # создаём только недостающие
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(), nullable=True),
+            sa.Column('email', sa.String(), nullable=True),
+            sa.Column('password_hash', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+        op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+        op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+
+    if 'social_accounts' not in existing:
+        op.create_table(
+            'social_accounts',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('platform', sa.String(), nullable=True),
+            sa.Column('account_name', sa.String(), nullable=True),
+            sa.Column('access_token', sa.String(), nullable=True),
+            sa.Column('refresh_token', sa.String(), nullable=True),
+            sa.Column('token_expires_at', sa.DateTime(), nullable=True),
+            sa.Column('settings', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+            sa.Column('is_active', sa.Boolean(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_social_accounts_id'), 'social_accounts', ['id'], unique=False)
+        op.create_index(op.f('ix_social_accounts_platform'), 'social_accounts', ['platform'], unique=False)
+
+    if 'posts' not in existing:
+        op.create_table(
+            'posts',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('source_account_id', sa.Integer(), nullable=True),
+            sa.Column('post_id', sa.String(), nullable=True),
+            sa.Column('content', sa.String(), nullable=True),
+            sa.Column('media_urls', sa.String(), nullable=True),
+            sa.Column('posted_at', sa.DateTime(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.ForeignKeyConstraint(['source_account_id'], ['social_accounts.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_posts_id'), 'posts', ['id'], unique=False)
+
+    if 'statistics' not in existing:
+        op.create_table(
+            'statistics',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('account_id', sa.Integer(), nullable=True),
+            sa.Column('date', sa.Date(), nullable=True),
+            sa.Column('posts_count', sa.Integer(), nullable=True),
+            sa.Column('reposts_count', sa.Integer(), nullable=True),
+            sa.Column('total_posts_made', sa.Integer(), nullable=True),
+            sa.Column('time_spent_seconds', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+            sa.ForeignKeyConstraint(['account_id'], ['social_accounts.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_statistics_id'), 'statistics', ['id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_statistics_id'), table_name='statistics')
+    op.drop_table('statistics')
+    op.drop_index(op.f('ix_posts_id'), table_name='posts')
+    op.drop_table('posts')
+    op.drop_index(op.f('ix_social_accounts_platform'), table_name='social_accounts')
+    op.drop_index(op.f('ix_social_accounts_id'), table_name='social_accounts')
+    op.drop_table('social_accounts')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.drop_index(op.f('ix_users_username'), table_name='users')
+    op.drop_index(op.f('ix_users_id'), table_name='users')
+    op.drop_table('users')
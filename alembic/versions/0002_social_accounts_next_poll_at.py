@@ -0,0 +1,27 @@
+"""next poll time on social accounts
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Когда аккаунт-источник нужно опросить в следующий раз; индекс — для выборки планировщиком
+    op.add_column('social_accounts', sa.Column('next_poll_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_social_accounts_due', 'social_accounts', ['is_active', 'next_poll_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_social_accounts_due', table_name='social_accounts')
+    op.drop_column('social_accounts', 'next_poll_at')
@@ -0,0 +1,28 @@
+"""adaptive polling state on social accounts
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('social_accounts', sa.Column('last_polled_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('social_accounts', sa.Column('poll_interval_seconds', sa.Integer(), nullable=True))
+    op.add_column('social_accounts', sa.Column('posting_rate', sa.Float(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('social_accounts', 'posting_rate')
+    op.drop_column('social_accounts', 'poll_interval_seconds')
+    op.drop_column('social_accounts', 'last_polled_at')
@@ -0,0 +1,25 @@
+"""poll cursor on social accounts
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Последний увиденный пост источника для инкрементального опроса
+    op.add_column('social_accounts', sa.Column('poll_cursor', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('social_accounts', 'poll_cursor')
@@ -0,0 +1,46 @@
+"""deliveries table
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Доставки постов в целевые аккаунты
+    op.create_table(
+        'deliveries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('target_account_id', sa.Integer(), nullable=False),
+        sa.Column('state', sa.String(), nullable=False),
+        sa.Column('target_post_id', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id']),
+        sa.ForeignKeyConstraint(['target_account_id'], ['social_accounts.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('post_id', 'target_account_id', name='uq_deliveries_post_target')
+    )
+    op.create_index(op.f('ix_deliveries_id'), 'deliveries', ['id'], unique=False)
+    op.create_index('ix_deliveries_target_state', 'deliveries', ['target_account_id', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_deliveries_target_state', table_name='deliveries')
+    op.drop_index(op.f('ix_deliveries_id'), table_name='deliveries')
+    op.drop_table('deliveries')
@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, UploadFile, Form
 from fastapi.responses import JSONResponse
 from typing import List, Optional
-import asyncio
 from datetime import datetime
 import json
 import os
@@ -11,6 +10,7 @@ import shutil
 from app.models.social_account import SocialAccount as SocialAccountModel
 from app.models.post import Post as PostModel
 from app.models.statistics import Statistics as StatisticsModel
+from app.models.delivery import Delivery as DeliveryModel
 from app.models.user import User as UserModel
 from app.schemas.social_account import SocialAccountCreate, SocialAccountPublic
 from app.schemas.post import PostCreate, Post as PostSchema
@@ -18,13 +18,16 @@ from app.schemas.statistics import StatisticsCreate, Statistics as StatisticsSch
 from app.database import SessionLocal, engine
 from app.core.config import settings
 from app.core.security import hash_password
-from app.social.vk_client import VKClient
-from app.social.telegram_client import TelegramClient
-from app.social.instagram_client import InstagramClient
-from app.social.pinterest_client import PinterestClient
-from app.social.youtube_client import YouTubeClient
+from app.social.vk_client import get_vk_client
+from app.social.telegram_client import get_telegram_client
+from app.social.instagram_client import get_instagram_client
+from app.social.pinterest_client import get_pinterest_client
+from app.social.youtube_client import get_youtube_client
 from app.social.vk_auth_client import VKAuthClient
-from app.tasks.monitoring import repost_to_telegram, repost_to_vk, send_test_post_to_all_platforms
+from app.utils.async_loop import run_async
+from app.services.deliveries import create_deliveries, delivery_counts, reset_failed_deliveries
+from app.services.publish_jobs import source_key
+from app.tasks.monitoring import celery_app, repost_to_telegram, repost_to_vk, send_test_post_to_all_platforms
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -36,27 +39,6 @@ def get_db():
         db.close()
 
 
-def run_async(coro):
-    """Безопасное выполнение async функции в синхронном контексте"""
-    try:
-        # Пробуем получить запущенный loop
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        # Нет запущенного loop - создаём новый
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            return loop.run_until_complete(coro)
-        finally:
-            loop.close()
-    else:
-        # Loop уже запущен - создаём task и ждём её результат
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(asyncio.run, coro)
-            return future.result()
-
-
 def get_or_create_default_user(db):
     """Получить или создать пользователя по умолчанию"""
     user = db.query(UserModel).filter(UserModel.id == 1).first()
@@ -160,8 +142,16 @@ async def send_test_post(
                 "settings": account.settings or {}
             })
         
+        # Доставки во все целевые аккаунты — одним INSERT; воркеры обновляют их состояние
+        delivery_ids = create_deliveries(db, test_post.id, [account["id"] for account in accounts_data])
+        db.commit()
+        for account in accounts_data:
+            account["delivery_id"] = delivery_ids.get(account["id"])
+        
         # Подготовка данных поста
         post_data = {
+            "post_id": test_post.post_id,
+            "source_key": source_key("crossposter", "posts", test_post.id),
             "content": content,
             "media": media
         }
@@ -188,6 +178,7 @@ async def send_test_post(
             "success": True,
             "message": f"Тестовый пост отправлен {platform_msg} ({len(active_accounts)} аккаунт(ов))",
             "task_id": "async_task_added",
+            "post_id": test_post.id,
             "results": f"Test post queued for {len(active_accounts)} account(s)"
         }
     except Exception as e:
@@ -246,7 +237,7 @@ async def crosspost_posts(
         
         # Используем соответствующий клиент для получения постов из источника
         if source_platform == 'vk':
-            vk_client = VKClient(source_account.access_token)
+            vk_client = get_vk_client(source_account.access_token)
             # Получаем последние посты из VK
             posts = vk_client.get_latest_posts(str(source_account.settings.get('owner_id', '')), count=posts_count)
             for post in posts:
@@ -266,7 +257,7 @@ async def crosspost_posts(
                 })
                 
         elif source_platform == 'telegram':
-            telegram_client = TelegramClient(source_account.access_token)
+            telegram_client = get_telegram_client(source_account.access_token)
             posts = run_async(
                 telegram_client.get_latest_posts(str(source_account.settings.get('chat_id', '')), limit=posts_count)
             )
@@ -281,7 +272,7 @@ async def crosspost_posts(
                 })
                 
         elif source_platform == 'instagram':
-            instagram_client = InstagramClient(
+            instagram_client = get_instagram_client(
                 username=source_account.access_token.split(':')[0],
                 password=source_account.access_token.split(':')[1]
             )
@@ -299,7 +290,7 @@ async def crosspost_posts(
                 })
                 
         elif source_platform == 'pinterest':
-            pinterest_client = PinterestClient(source_account.access_token)
+            pinterest_client = get_pinterest_client(source_account.access_token)
             posts = pinterest_client.get_latest_pins(
                 board_id=str(source_account.settings.get('board_id', '')),
                 count=posts_count
@@ -314,7 +305,7 @@ async def crosspost_posts(
                 })
                 
         elif source_platform == 'youtube':
-            youtube_client = YouTubeClient(source_account.access_token)
+            youtube_client = get_youtube_client(source_account.access_token)
             posts = youtube_client.get_latest_videos(
                 channel_id=str(source_account.settings.get('channel_id', '')),
                 count=posts_count
@@ -332,23 +323,16 @@ async def crosspost_posts(
         results = []
         for i, post_data in enumerate(posts_to_repost[:posts_count]):
             if target_platform == 'vk':
-                vk_client = VKClient(target_account.access_token)
+                vk_client = get_vk_client(target_account.access_token)
                 
                 # Обработка медиафайлов для VK
                 attachments = []
                 if post_data.get('media'):
-                    for media_url in post_data['media']:
-                        # Скачиваем и загружаем медиа в VK
-                        from app.utils.media_downloader import download_media, get_file_extension
-                        file_extension = get_file_extension(media_url)
-                        temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-                        
-                        downloaded_path = download_media(media_url, temp_filename)
-                        if downloaded_path:
-                            # Загружаем в VK
-                            attachment = vk_client.upload_photo(downloaded_path, str(target_account.settings.get('group_id', '')))
-                            if attachment:
-                                attachments.append(attachment)
+                    # Скачиваем медиа параллельно и загружаем в VK все фото разом
+                    from app.utils.media_cache import fetch_media, prefetch_media
+                    prefetch_media(post_data['media'])
+                    photo_paths = [path for path in (fetch_media(url) for url in post_data['media']) if path]
+                    attachments = vk_client.upload_photos(photo_paths, str(target_account.settings.get('group_id', '')))
                 
                 result = vk_client.post_to_wall(
                     owner_id=str(target_account.settings.get('group_id', '')),
@@ -358,7 +342,7 @@ async def crosspost_posts(
                 results.append(result)
                 
             elif target_platform == 'telegram':
-                telegram_client = TelegramClient(target_account.access_token)
+                telegram_client = get_telegram_client(target_account.access_token)
                 result = run_async(
                     telegram_client.post_to_channel(
                         chat_id=str(target_account.settings.get('channel', '')),
@@ -372,21 +356,19 @@ async def crosspost_posts(
                 # Для Instagram нужно использовать учетные данные
                 credentials = target_account.access_token.split(':')
                 if len(credentials) >= 2:
-                    instagram_client = InstagramClient(
+                    instagram_client = get_instagram_client(
                         username=credentials[0],
                         password=credentials[1]
                     )
                     
                     # Instagram требует медиафайл для публикации
                     if post_data.get('media'):
-                        from app.utils.media_downloader import download_media, get_file_extension
+                        from app.utils.media_cache import fetch_media
                         
                         media_url = post_data['media'][0]  # берем первое медиа
                         
                         # Скачиваем медиафайл для Instagram
-                        file_extension = get_file_extension(media_url)
-                        temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-                        downloaded_path = download_media(media_url, temp_filename)
+                        downloaded_path = fetch_media(media_url)
                         
                         if not downloaded_path:
                             results.append({'error': 'Не удалось скачать медиафайл для Instagram'})
@@ -410,7 +392,7 @@ async def crosspost_posts(
                         results.append({'error': 'Instagram requires media file for posting'})
             
             elif target_platform == 'pinterest':
-                pinterest_client = PinterestClient(target_account.access_token)
+                pinterest_client = get_pinterest_client(target_account.access_token)
                 
                 if post_data.get('media'):
                     media_url = post_data['media'][0]  # берем первое медиа
@@ -425,7 +407,7 @@ async def crosspost_posts(
                     results.append({'error': 'Pinterest requires media file for posting'})
                 
             elif target_platform == 'youtube':
-                youtube_client = YouTubeClient(target_account.access_token)
+                youtube_client = get_youtube_client(target_account.access_token)
                 
                 if post_data.get('media'):
                     media_path = post_data['media'][0]  # берем первое медиа
@@ -496,7 +478,7 @@ async def preview_posts(
        
        # Используем соответствующий клиент для получения постов из источника
        if source_platform == 'vk':
-           vk_client = VKClient(source_account.access_token)
+           vk_client = get_vk_client(source_account.access_token)
            # Получаем последние посты из VK
            posts = vk_client.get_latest_posts(str(source_account.settings.get('owner_id', '')), count=limit)
            for post in posts:
@@ -525,7 +507,7 @@ async def preview_posts(
                })
                
        elif source_platform == 'telegram':
-           telegram_client = TelegramClient(source_account.access_token)
+           telegram_client = get_telegram_client(source_account.access_token)
            posts = run_async(
                telegram_client.get_latest_posts(str(source_account.settings.get('chat_id', '')), limit=limit)
            )
@@ -549,7 +531,7 @@ async def preview_posts(
                })
                
        elif source_platform == 'instagram':
-           instagram_client = InstagramClient(
+           instagram_client = get_instagram_client(
                username=source_account.access_token.split(':')[0],
                password=source_account.access_token.split(':')[1]
            )
@@ -576,7 +558,7 @@ async def preview_posts(
                })
                
        elif source_platform == 'pinterest':
-           pinterest_client = PinterestClient(source_account.access_token)
+           pinterest_client = get_pinterest_client(source_account.access_token)
            posts = pinterest_client.get_latest_pins(
                board_id=str(source_account.settings.get('board_id', '')),
                count=limit
@@ -600,7 +582,7 @@ async def preview_posts(
                })
                
        elif source_platform == 'youtube':
-           youtube_client = YouTubeClient(source_account.access_token)
+           youtube_client = get_youtube_client(source_account.access_token)
            posts = youtube_client.get_latest_videos(
                channel_id=str(source_account.settings.get('channel_id', '')),
                count=limit
@@ -759,6 +741,9 @@ async def get_detailed_accounts_status(db=Depends(get_db)):
     
     accounts = db.query(SocialAccountModel).all()
     
+    # Доставки по всем аккаунтам — одним сгруппированным запросом
+    deliveries = delivery_counts(db)
+    
     # Группируем аккаунты по платформам
     platforms = {}
     
@@ -771,10 +756,7 @@ async def get_detailed_accounts_status(db=Depends(get_db)):
             sql_func.coalesce(sql_func.sum(StatisticsModel.posts_count), 0).label('total_posts')
         ).filter(StatisticsModel.account_id == account.id).first()
         
-        # Получаем количество тестовых постов
-        test_posts_count = db.query(PostModel).filter(
-            PostModel.status == "test"
-        ).count()
+        account_deliveries = deliveries.get(account.id, {})
         
         account_data = {
             "id": account.id,
@@ -785,7 +767,8 @@ async def get_detailed_accounts_status(db=Depends(get_db)):
             "settings": account.settings or {},
             "reposts_count": int(stats.total_reposts) if stats else 0,
             "posts_count": int(stats.total_posts) if stats else 0,
-            "test_posts_count": test_posts_count
+            "test_posts_count": account_deliveries.get('delivered', 0),
+            "deliveries": account_deliveries
         }
         
         if platform not in platforms:
@@ -911,13 +894,13 @@ async def validate_account_token(account_id: int, db=Depends(get_db)):
     
     try:
         if platform == 'vk':
-            vk_client = VKClient(account.access_token)
+            vk_client = get_vk_client(account.access_token)
             result = vk_client.validate_token()
             return result
             
         elif platform == 'telegram':
             # Для Telegram проверяем токен бота через Bot API
-            telegram_client = TelegramClient(account.access_token)
+            telegram_client = get_telegram_client(account.access_token)
             result = run_async(telegram_client.validate_token())
             return result
             
@@ -925,19 +908,19 @@ async def validate_account_token(account_id: int, db=Depends(get_db)):
             # Для Instagram пытаемся выполнить вход
             credentials = account.access_token.split(':')
             if len(credentials) >= 2:
-                instagram_client = InstagramClient(username=credentials[0], password=credentials[1])
+                instagram_client = get_instagram_client(username=credentials[0], password=credentials[1])
                 result = instagram_client.validate_token()
                 return result
             else:
                 return {"valid": False, "error": "Неверный формат учетных данных (ожидается логин:пароль)"}
                 
         elif platform == 'pinterest':
-            pinterest_client = PinterestClient(account.access_token)
+            pinterest_client = get_pinterest_client(account.access_token)
             result = pinterest_client.validate_token()
             return result
             
         elif platform == 'youtube':
-            youtube_client = YouTubeClient(account.access_token)
+            youtube_client = get_youtube_client(account.access_token)
             result = youtube_client.validate_token()
             return result
             
@@ -946,3 +929,208 @@ async def validate_account_token(account_id: int, db=Depends(get_db)):
             
     except Exception as e:
         return {"valid": False, "error": str(e), "message": "Ошибка при проверке токена"}
+
+
+
+@router.post("/social-accounts/{account_id}/telegram-webhook")
+async def set_telegram_webhook(account_id: int, request: dict, db=Depends(get_db)):
+    """
+    Переключить Telegram-источник на вебхук.
+    Вебхук ставится на бота, поэтому на него переходят все источники с тем же ботом.
+    request: {"base_url": "https://example.com"} — публичный адрес этого приложения
+    """
+    from app.services.telegram_updates import TelegramUpdateDispatcher
+
+    account = db.query(SocialAccountModel).filter(SocialAccountModel.id == account_id).first()
+
+    if not account or account.platform != 'telegram':
+        raise HTTPException(status_code=404, detail="Telegram-аккаунт не найден")
+
+    chat_id = (account.settings or {}).get('chat_id')
+    if not chat_id:
+        raise HTTPException(status_code=400, detail="Не указан chat_id источника")
+
+    if not settings.telegram_webhook_secret:
+        raise HTTPException(status_code=400, detail="Не задан TELEGRAM_WEBHOOK_SECRET")
+
+    base_url = (request.get('base_url') or '').rstrip('/')
+    if not base_url:
+        raise HTTPException(status_code=400, detail="Не указан base_url")
+
+    # Вебхук находит аккаунт чата по Redis, без обращения к БД
+    dispatcher = TelegramUpdateDispatcher(account.access_token)
+    dispatcher.register_chat(chat_id, account.id)
+
+    telegram_client = get_telegram_client(account.access_token)
+    result = run_async(telegram_client.set_webhook(
+        url=f"{base_url}/api/v1/webhooks/telegram/{dispatcher.bot_id}",
+        secret_token=settings.telegram_webhook_secret
+    ))
+    if not result.get('success'):
+        return result
+
+    # Вебхук ставится на бота целиком: все источники с этим ботом больше не опрашиваются
+    # через getUpdates (Telegram отвечал бы 409 Conflict)
+    dispatcher.set_webhook_mode(True)
+    bot_accounts = db.query(SocialAccountModel).filter(
+        SocialAccountModel.platform == 'telegram',
+        SocialAccountModel.is_active == True
+    ).all()
+    for bot_account in bot_accounts:
+        if bot_account.id == account.id or bot_account.access_token == account.access_token:
+            bot_account.settings = {**(bot_account.settings or {}), 'ingest_mode': 'webhook'}
+            chat_id = (bot_account.settings or {}).get('chat_id')
+            if chat_id:
+                dispatcher.register_chat(chat_id, bot_account.id)
+    db.commit()
+
+    return result
+
+
+
+@router.post("/social-accounts/{account_id}/vk-callback")
+async def set_vk_callback(account_id: int, request: dict, db=Depends(get_db)):
+    """
+    Переключить VK-источник с опроса wall.get на Callback API.
+    request: {"base_url": "https://example.com"} — публичный адрес этого приложения
+    """
+    from app.services.vk_callback import register_callback_group
+
+    account = db.query(SocialAccountModel).filter(SocialAccountModel.id == account_id).first()
+
+    if not account or account.platform != 'vk':
+        raise HTTPException(status_code=404, detail="VK-аккаунт не найден")
+
+    owner_id = str((account.settings or {}).get('owner_id', ''))
+    if not owner_id.startswith('-'):
+        raise HTTPException(status_code=400, detail="Callback API доступен только для сообществ (owner_id со знаком «-»)")
+
+    if not settings.vk_callback_secret:
+        raise HTTPException(status_code=400, detail="Не задан VK_CALLBACK_SECRET")
+
+    base_url = (request.get('base_url') or '').rstrip('/')
+    if not base_url:
+        raise HTTPException(status_code=400, detail="Не указан base_url")
+
+    group_id = int(owner_id.lstrip('-'))
+    vk_client = get_vk_client(account.access_token)
+
+    # Строка подтверждения нужна вебхуку до того, как VK пришлёт событие confirmation
+    try:
+        confirmation_code = vk_client.get_callback_confirmation_code(group_id)
+    except Exception as e:
+        return {"error": str(e)}
+    register_callback_group(group_id, account.id, confirmation_code)
+
+    result = vk_client.register_callback_server(
+        group_id=group_id,
+        url=f"{base_url}/api/v1/webhooks/vk",
+        secret_key=settings.vk_callback_secret
+    )
+    if 'error' in result:
+        return result
+
+    account.settings = {**(account.settings or {}), 'ingest_mode': 'callback'}
+    db.commit()
+
+    return {"success": True, "server_id": result['server_id']}
+
+
+@router.get("/dead-letters")
+async def list_dead_letters(offset: int = 0, limit: int = 100):
+    """Публикации, исчерпавшие повторы (без аргументов задач — в них токены)"""
+    from app.services.publish_jobs import dead_letters
+
+    return {
+        "total": dead_letters.size(),
+        "items": dead_letters.peek(offset, limit)
+    }
+
+
+@router.post("/dead-letters/replay")
+async def replay_dead_letters(request: dict):
+    """
+    Поставить недоставленные публикации обратно в очередь Celery.
+    request: {"ids": [...]} — выбранные записи, {"all": true} — все.
+    Уже выполненные к этому моменту публикации повторно не отправляются.
+    """
+    from app.services.publish_jobs import dead_letters
+
+    if request.get('all'):
+        entries = dead_letters.take()
+    elif request.get('ids'):
+        entries = dead_letters.take(request['ids'])
+    else:
+        raise HTTPException(status_code=400, detail="Укажите ids или all")
+
+    task_ids = []
+    for entry in entries:
+        result = celery_app.send_task(entry['task'], args=entry['args'], kwargs=entry['kwargs'])
+        task_ids.append(result.id)
+
+    return {"replayed": len(task_ids), "task_ids": task_ids}
+
+
+@router.get("/posts/{post_id}/deliveries")
+async def get_post_deliveries(post_id: int, db=Depends(get_db)):
+    """Состояние доставки поста в каждый целевой аккаунт"""
+    deliveries = db.query(DeliveryModel).filter(DeliveryModel.post_id == post_id).all()
+
+    return [
+        {
+            "id": delivery.id,
+            "target_account_id": delivery.target_account_id,
+            "state": delivery.state,
+            "target_post_id": delivery.target_post_id,
+            "attempts": delivery.attempts,
+            "last_error": delivery.last_error,
+            "created_at": delivery.created_at.isoformat() if delivery.created_at else None,
+            "started_at": delivery.started_at.isoformat() if delivery.started_at else None,
+            "finished_at": delivery.finished_at.isoformat() if delivery.finished_at else None
+        }
+        for delivery in deliveries
+    ]
+
+
+@router.post("/posts/{post_id}/deliveries/retry")
+async def retry_post_deliveries(post_id: int, db=Depends(get_db)):
+    """Повторить доставку поста только в те аккаунты, куда она не удалась или зависла"""
+    from app.tasks.monitoring import send_post_to_account
+
+    post = db.query(PostModel).filter(PostModel.id == post_id).first()
+    if not post:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+
+    deliveries = reset_failed_deliveries(db, post_id)
+    if not deliveries:
+        return {"retried": 0}
+
+    accounts = {
+        account.id: account for account in db.query(SocialAccountModel).filter(
+            SocialAccountModel.id.in_([delivery.target_account_id for delivery in deliveries])
+        )
+    }
+    # Тот же source_key, что и при первой отправке: уже доставленное повторно не публикуется
+    post_data = {
+        "post_id": post.post_id,
+        "source_key": source_key("crossposter", "posts", post.id),
+        "content": post.content,
+        "media": json.loads(post.media_urls) if post.media_urls else []
+    }
+
+    retried = 0
+    for delivery in deliveries:
+        account = accounts.get(delivery.target_account_id)
+        if not account:
+            continue
+        send_post_to_account.delay(post_data, {
+            "id": account.id,
+            "platform": account.platform,
+            "access_token": account.access_token,
+            "username": account.account_name,
+            "settings": account.settings or {},
+            "delivery_id": delivery.id
+        })
+        retried += 1
+
+    return {"retried": retried}
@@ -0,0 +1,99 @@
+import hmac
+from typing import Dict, Optional
+from fastapi import APIRouter, HTTPException, Header, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.services.telegram_updates import get_chat_account, push_chat_posts
+from app.services.vk_callback import get_callback_group
+from app.tasks.monitoring import ingest_telegram_chat, ingest_vk_posts
+
+router = APIRouter(prefix="/webhooks", tags=["webhooks"])
+
+
+def channel_post_to_post(message: Dict) -> Dict:
+    """
+    Преобразовать channel_post из JSON-обновления Telegram в словарь поста
+    того же вида, что возвращает TelegramClient.get_latest_posts
+    """
+    post = {
+        'id': message['message_id'],
+        'text': message.get('text') or message.get('caption') or '',
+        'date': message.get('date'),
+        'media': [],
+        'media_url': None,
+    }
+
+    if message.get('photo'):
+        # Берём фото наибольшего размера
+        largest_photo = max(message['photo'], key=lambda p: p.get('file_size') or 0)
+        post['media'] = [largest_photo['file_id']]
+        post['media_url'] = largest_photo['file_id']
+    elif message.get('video'):
+        post['media'] = [message['video']['file_id']]
+        post['media_url'] = message['video']['file_id']
+
+    return post
+
+
+@router.post("/telegram/{bot_id}")
+async def telegram_webhook(
+    bot_id: str,
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None)
+):
+    """
+    Принять обновление Telegram (вебхук бота bot_id).
+
+    Запрос не обращается к БД: пост кладётся в очередь чата в Redis, а его обработку
+    выполняет задача ingest_telegram_chat. Чаты без зарегистрированного аккаунта
+    игнорируются.
+    """
+    secret = settings.telegram_webhook_secret
+    if not secret or not hmac.compare_digest(x_telegram_bot_api_secret_token or '', secret):
+        raise HTTPException(status_code=403, detail="Неверный секретный токен")
+
+    update = await request.json()
+    message = update.get('channel_post')
+    if not message:
+        return {"ok": True}
+
+    chat_id = str(message['chat']['id'])
+    account_id = get_chat_account(bot_id, chat_id)
+    if not account_id:
+        return {"ok": True}
+
+    push_chat_posts(bot_id, chat_id, [channel_post_to_post(message)])
+    ingest_telegram_chat.delay(account_id, bot_id, chat_id)
+
+    return {"ok": True}
+
+
+@router.post("/vk", response_class=PlainTextResponse)
+async def vk_callback(request: Request):
+    """
+    Принять событие VK Callback API.
+
+    На confirmation отвечаем строкой подтверждения сообщества, wall_post_new
+    ставим в задачу ingest_vk_posts. VK ждёт ответ «ok» на любое событие,
+    иначе будет повторять его.
+    """
+    event = await request.json()
+    group = get_callback_group(event.get('group_id'))
+    if not group:
+        raise HTTPException(status_code=404, detail="Сообщество не подключено")
+
+    if event.get('type') == 'confirmation':
+        return group['confirmation_code']
+
+    secret = settings.vk_callback_secret
+    if not secret or not hmac.compare_digest(event.get('secret') or '', secret):
+        raise HTTPException(status_code=403, detail="Неверный секретный ключ")
+
+    if event.get('type') == 'wall_post_new':
+        post = event.get('object') or {}
+        # Отложенные и предложенные посты ещё не опубликованы
+        if post.get('post_type', 'post') == 'post':
+            ingest_vk_posts.delay(group['account_id'], [post])
+
+    return "ok"
@@ -8,6 +8,9 @@ class Settings(BaseSettings):
     
     # Redis
     redis_url: str = "redis://localhost:6379/0"
+    # Через сколько брокер Redis отдаёт неподтверждённую задачу (acks_late) другому воркеру.
+    # Должно быть больше самой долгой задачи — перекодирования и загрузки видео
+    celery_visibility_timeout_seconds: int = 4 * 3600
     
     # Security
     secret_key: str = "crossposter_secret_key"
@@ -22,6 +25,87 @@ class Settings(BaseSettings):
     pinterest_api_key: str = ""
     youtube_api_key: str = ""
     
+    # Планировщик опроса источников
+    scheduler_tick_seconds: int = 60  # Как часто планировщик ищет аккаунты для опроса
+    poll_default_interval_seconds: int = 60  # Интервал опроса аккаунта по умолчанию
+    poll_batch_size: int = 500  # Сколько аккаунтов читать из БД за один запрос
+    poll_max_dispatch_per_tick: int = 2000  # Максимум задач опроса за один тик
+    scheduler_shard_count: int = 1  # Количество экземпляров планировщика
+    scheduler_shard_index: int = 0  # Номер этого экземпляра (0..shard_count-1)
+    poll_min_interval_seconds: int = 60  # Нижняя граница адаптивного интервала
+    poll_max_interval_seconds: int = 3600  # Верхняя граница адаптивного интервала
+    poll_backoff_factor: float = 1.5  # Во сколько раз растёт интервал после пустого опроса
+    poll_rate_smoothing: float = 0.3  # Вес нового наблюдения в экспоненциальном среднем
+    poll_target_posts_per_poll: float = 0.5  # Сколько новых постов в среднем ожидаем за опрос
+    vk_poll_page_size: int = 10  # Размер первой страницы wall.get при опросе
+    vk_poll_max_pages: int = 10  # Сколько страниц дочитывать после простоя
+    vk_callback_secret: str = ""  # Секретный ключ Callback API; пустое значение отключает приём событий
+    vk_execute_batch_size: int = 25  # Сколько wall.get упаковывать в один execute (максимум VK — 25)
+    vk_upload_concurrency: int = 5  # Сколько фото одновременно отправлять на сервер загрузки
+    vk_upload_server_ttl_seconds: int = 600  # Сколько переиспользовать адрес сервера загрузки
+    
+    # Раздача обновлений Telegram-ботов по чатам
+    telegram_ingest_mode: str = "polling"  # polling — getUpdates, webhook — вебхук /api/v1/webhooks/telegram
+    telegram_webhook_secret: str = ""  # secret_token вебхука; пустое значение отключает вебхук
+    telegram_long_poll_timeout: int = 25  # Таймаут длинного опроса getUpdates (секунды)
+    telegram_chat_queue_max: int = 1000  # Максимум непрочитанных постов в очереди чата
+    telegram_chat_queue_ttl_seconds: int = 7 * 24 * 3600
+    
+    # Индекс уже обработанных постов (Redis)
+    seen_posts_max_per_account: int = 1000  # Сколько последних ID хранить на источник
+    seen_posts_ttl_seconds: int = 30 * 24 * 3600  # Срок жизни индекса без опросов
+    
+    # Скачивание медиафайлов
+    media_max_download_bytes: int = 1024 ** 3  # Файлы больше 1 ГБ не скачиваем
+    media_download_retries: int = 3  # Сколько раз продолжать оборванную передачу
+    media_download_concurrency: int = 20  # Максимум одновременных соединений загрузчика
+    media_download_concurrency_per_host: int = 4  # Максимум одновременных загрузок с одного хоста
+    
+    # Общий кэш скачанных медиафайлов на хосте
+    media_cache_dir: str = "/tmp/crossposter_media"
+    media_cache_max_bytes: int = 5 * 1024 ** 3  # 5 ГБ
+    media_cache_ttl_seconds: int = 6 * 3600  # Через сколько URL скачивается заново
+    
+    # Перекодирование видео под требования платформ (ffmpeg)
+    media_transcode_enabled: bool = True
+    media_transcode_concurrency: int = 2  # Одновременных ffmpeg на хост
+    media_transcode_timeout_seconds: int = 1800
+    media_transcode_preset: str = "veryfast"  # Пресет libx264
+    media_transcode_trim_overlength: bool = False  # Обрезать видео длиннее лимита платформы вместо отказа
+    ffmpeg_path: str = "ffmpeg"
+    ffprobe_path: str = "ffprobe"
+    
+    # Реестр медиафайлов, уже загруженных на платформы (Redis)
+    uploaded_assets_ttl_seconds: int = 30 * 24 * 3600  # Сколько переиспользовать file_id/attachment
+    
+    # Пул клиентов соцсетей в каждом процессе
+    client_pool_max_size: int = 100
+    client_pool_idle_seconds: int = 900
+    instagram_session_ttl_seconds: int = 30 * 24 * 3600  # Срок хранения сессии Instagram
+    
+    # Лимиты частоты запросов к платформам (общие для всех воркеров, Redis)
+    rate_limit_vk_per_second: float = 3  # Запросов к API VK в секунду на токен
+    rate_limit_telegram_bot_per_second: float = 30  # Запросов к Bot API в секунду на бота
+    rate_limit_telegram_chat_per_minute: float = 20  # Сообщений в минуту в один чат
+    rate_limit_telegram_retries: int = 3  # Сколько раз повторять запрос после RetryAfter
+    rate_limit_max_wait_seconds: int = 300  # Дольше этого лимита не ждём — ошибка
+    
+    # Повторы публикаций и очередь недоставленных
+    publish_max_retries: int = 5  # Сколько раз повторять публикацию после временной ошибки
+    publish_retry_backoff_seconds: int = 10  # Первая задержка, дальше удваивается
+    publish_retry_backoff_max_seconds: int = 600
+    publish_lease_seconds: int = 60  # Аренда публикации; продлевается, пока воркер жив
+    publish_record_ttl_seconds: int = 30 * 24 * 3600  # Сколько помнить выполненные публикации
+    delivery_stale_seconds: int = 3 * 3600  # Доставка без изменений дольше этого считается зависшей
+    
+    # Загрузка видео в YouTube
+    youtube_upload_chunk_bytes: int = 8 * 1024 * 1024  # Размер части (кратен 256 КБ)
+    youtube_upload_retries: int = 3  # Повторы части при сетевых ошибках и 5xx
+    youtube_upload_session_ttl_seconds: int = 6 * 24 * 3600  # Resumable-сессия YouTube живёт около недели
+    
+    # Фоновый event loop для async-клиентов в воркерах
+    async_loop_use_uvloop: bool = True  # Использовать uvloop, если он установлен
+    
     # Добавляем переменные для PostgreSQL
     postgres_db: str = "crossposter"
     postgres_user: str = "crossposter"
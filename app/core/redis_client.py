@@ -0,0 +1,13 @@
+import redis
+from app.core.config import settings
+
+# Один пул соединений на процесс (воркер, планировщик или веб-сервер)
+_redis: redis.Redis = None
+
+
+def get_redis() -> redis.Redis:
+    """Получить общий клиент Redis для текущего процесса"""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _redis
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from app.models.database import Base
+
+class Delivery(Base):
+    """Доставка поста в один целевой аккаунт"""
+    __tablename__ = "deliveries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)  # Исходный пост
+    target_account_id = Column(Integer, ForeignKey("social_accounts.id"), nullable=False)
+    state = Column(String, nullable=False, default="pending")  # pending, in_progress, retrying, delivered, failed
+    target_post_id = Column(String, nullable=True)  # ID опубликованного поста в целевой соцсети
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)  # Начало первой попытки
+    finished_at = Column(DateTime(timezone=True), nullable=True)  # Доставлен или окончательно не доставлен
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        # Один пост доставляется в аккаунт один раз; индекс же обслуживает выборку по посту
+        UniqueConstraint("post_id", "target_account_id", name="uq_deliveries_post_target"),
+        # Статистика и повтор недоставленных по аккаунту
+        Index("ix_deliveries_target_state", "target_account_id", "state"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.sql import func
 from app.models.database import Base
@@ -18,6 +18,17 @@ class SocialAccount(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Когда аккаунт-источник нужно опросить в следующий раз (NULL — как можно скорее)
+    next_poll_at = Column(DateTime(timezone=True), nullable=True)
+    last_polled_at = Column(DateTime(timezone=True), nullable=True)
+    poll_interval_seconds = Column(Integer, nullable=True)  # Текущий адаптивный интервал опроса
+    posting_rate = Column(Float, nullable=True)  # Сглаженная частота постов источника (постов в час)
+    poll_cursor = Column(String, nullable=True)  # Последний увиденный пост источника (например, ID поста VK)
+
+    __table_args__ = (
+        # Планировщик выбирает только «созревшие» аккаунты по этому индексу
+        Index("ix_social_accounts_due", "is_active", "next_poll_at"),
+    )
 
     @property
     def access_token(self):
@@ -1,8 +1,15 @@
 import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from app.tasks.monitoring import check_vk_posts, check_telegram_posts, check_instagram_posts, repost_to_telegram
+from sqlalchemy import or_
+from app.tasks.monitoring import (
+    check_vk_posts, check_vk_posts_batch, check_telegram_posts, check_instagram_posts, repost_to_telegram
+)
 from app.core.config import settings
+from app.database import SessionLocal
+from app.models.social_account import SocialAccount as SocialAccountModel
 import logging
 import pytz
 
@@ -10,32 +17,172 @@ import pytz
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Платформы, которые умеем опрашивать как источники
+POLLED_PLATFORMS = ('vk', 'telegram', 'instagram')
+
 # Инициализация планировщика
 scheduler = AsyncIOScheduler(timezone=pytz.UTC)
 
-@scheduler.scheduled_job(IntervalTrigger(minutes=1))
+
+def _build_poll_task(account: SocialAccountModel) -> Optional[Tuple]:
+    """
+    Подобрать задачу проверки и её аргументы для аккаунта.
+    Возвращает None, если у аккаунта не настроен источник.
+    """
+    account_settings = account.settings or {}
+
+    if account.platform == 'vk':
+        owner_id = account_settings.get('owner_id')
+        # Сообщества на Callback API присылают посты сами
+        if not owner_id or account_settings.get('ingest_mode') == 'callback':
+            return None
+        since_id = int(account.poll_cursor) if account.poll_cursor else None
+        return check_vk_posts, (account.id, account.access_token, str(owner_id), since_id)
+
+    if account.platform == 'telegram':
+        chat_id = account_settings.get('chat_id')
+        # Боты на вебхуке присылают посты сами
+        if not chat_id or account_settings.get('ingest_mode') == 'webhook':
+            return None
+        return check_telegram_posts, (account.id, account.access_token, str(chat_id))
+
+    if account.platform == 'instagram':
+        user_id = account_settings.get('user_id')
+        # Для Instagram access_token содержит логин:пароль
+        credentials = (account.access_token or '').split(':', 1)
+        if not user_id or len(credentials) < 2:
+            return None
+        return check_instagram_posts, (account.id, credentials[0], credentials[1], str(user_id))
+
+    return None
+
+
+def _dispatch_vk_groups(vk_groups: Dict[str, List[list]]):
+    """
+    Поставить задачи опроса VK, объединяя сообщества с одним токеном
+    в пачки по vk_execute_batch_size (один запрос execute на пачку)
+    """
+    batch_size = settings.vk_execute_batch_size
+    for access_token, accounts in vk_groups.items():
+        for i in range(0, len(accounts), batch_size):
+            chunk = accounts[i:i + batch_size]
+            if len(chunk) == 1:
+                check_vk_posts.delay(chunk[0][0], access_token, *chunk[0][1:])
+            else:
+                check_vk_posts_batch.delay(access_token, chunk)
+
+
+def _due_accounts_query(db, now: datetime, batch_size: int):
+    """Запрос очередной пачки аккаунтов, которые пора опросить"""
+    query = db.query(SocialAccountModel).filter(
+        SocialAccountModel.is_active == True,
+        SocialAccountModel.platform.in_(POLLED_PLATFORMS),
+        or_(SocialAccountModel.next_poll_at == None, SocialAccountModel.next_poll_at <= now),
+    )
+
+    # Несколько экземпляров планировщика делят аккаунты по остатку от ID
+    if settings.scheduler_shard_count > 1:
+        query = query.filter(
+            SocialAccountModel.id % settings.scheduler_shard_count == settings.scheduler_shard_index
+        )
+
+    # skip_locked — чтобы параллельные планировщики не брали одни и те же строки
+    return (
+        query.order_by(SocialAccountModel.next_poll_at.asc().nullsfirst())
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def dispatch_due_accounts(now: Optional[datetime] = None) -> int:
+    """
+    Поставить в очередь задачи проверки для аккаунтов, у которых наступило next_poll_at.
+
+    Аккаунты читаются пачками по индексу (is_active, next_poll_at), поэтому стоимость
+    тика пропорциональна числу «созревших» аккаунтов, а не общему числу источников.
+    За тик ставится не больше poll_max_dispatch_per_tick задач — остаток подхватит
+    следующий тик.
+    """
+    now = now or datetime.now(timezone.utc)
+    batch_size = max(1, min(settings.poll_batch_size, settings.poll_max_dispatch_per_tick))
+    dispatched = 0
+    scanned = 0
+    # access_token -> [[account_id, owner_id, since_id], ...]
+    vk_groups: Dict[str, List[list]] = {}
+
+    db = SessionLocal()
+    try:
+        while scanned < settings.poll_max_dispatch_per_tick:
+            limit = min(batch_size, settings.poll_max_dispatch_per_tick - scanned)
+            accounts: List[SocialAccountModel] = _due_accounts_query(db, now, limit).all()
+            if not accounts:
+                break
+
+            for account in accounts:
+                scanned += 1
+                # Сдвигаем next_poll_at сразу, чтобы аккаунт не попал в следующую пачку/тик,
+                # пока задача проверки ещё выполняется
+                # (задача после опроса сама назначит время по адаптивному интервалу)
+                interval = account.poll_interval_seconds or settings.poll_default_interval_seconds
+                account.next_poll_at = now + timedelta(seconds=interval)
+
+                try:
+                    poll_task = _build_poll_task(account)
+                except Exception as e:
+                    # Например, токен не удалось расшифровать
+                    logger.error(f"Cannot prepare poll task for account {account.id} ({account.platform}): {e}")
+                    continue
+
+                if not poll_task:
+                    # Источник не настроен — заглядываем к аккаунту как можно реже
+                    account.next_poll_at = now + timedelta(seconds=settings.poll_max_interval_seconds)
+                    continue
+
+                task, args = poll_task
+                if task is check_vk_posts:
+                    account_id, access_token, owner_id, since_id = args
+                    vk_groups.setdefault(access_token, []).append([account_id, owner_id, since_id])
+                else:
+                    task.delay(*args)
+                dispatched += 1
+
+            db.commit()
+            _dispatch_vk_groups(vk_groups)
+            vk_groups = {}
+
+            if len(accounts) < limit:
+                break
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    return dispatched
+
+
+@scheduler.scheduled_job(IntervalTrigger(seconds=settings.scheduler_tick_seconds))
 async def check_all_social_media():
     """Проверить все социальные сети на наличие новых постов"""
     logger.info("Starting social media check...")
-    
-    # TODO: Получить список активных аккаунтов из базы данных
-    # TODO: Для каждого аккаунта запустить соответствующую задачу проверки
-    
-    # Пример запуска задач для проверки (нужно заменить на реальные данные из БД)
-    # check_vk_posts.delay(account_id, access_token, owner_id)
-    # check_telegram_posts.delay(account_id, bot_token, chat_id)
-    # check_instagram_posts.delay(account_id, username, password, user_id)
-    
-    logger.info("Social media check completed")
+
+    # Работа с БД синхронная — выполняем её вне event loop планировщика
+    try:
+        dispatched = await asyncio.to_thread(dispatch_due_accounts)
+    except Exception as e:
+        logger.error(f"Social media check failed: {e}")
+        return
+
+    logger.info(f"Social media check completed, dispatched {dispatched} poll task(s)")
 
 if __name__ == "__main__":
     # Запуск планировщика
     scheduler.start()
     logger.info("Scheduler started")
-    
+
     try:
         # Держим приложение запущенным
         asyncio.run(asyncio.sleep(float('inf')))
     except KeyboardInterrupt:
         logger.info("Scheduler stopped")
-        scheduler.shutdown()
\ No newline at end of file
+        scheduler.shutdown()
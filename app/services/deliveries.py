@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.dialects.postgresql import insert
+from app.core.config import settings
+from app.database import SessionLocal
+from app.models.delivery import Delivery as DeliveryModel
+
+
+def create_deliveries(db, post_id: int, account_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Создать доставки поста во все целевые аккаунты одним INSERT.
+    Уже существующие доставки не трогаются. Возвращает account_id -> ID новой доставки.
+    """
+    rows = [{'post_id': post_id, 'target_account_id': account_id, 'state': 'pending', 'attempts': 0}
+            for account_id in account_ids]
+    if not rows:
+        return {}
+
+    statement = (
+        insert(DeliveryModel)
+        .values(rows)
+        .on_conflict_do_nothing(constraint='uq_deliveries_post_target')
+        .returning(DeliveryModel.target_account_id, DeliveryModel.id)
+    )
+    return {account_id: delivery_id for account_id, delivery_id in db.execute(statement)}
+
+
+def _update_delivery(delivery_id: int, **values):
+    """Обновить доставку одним UPDATE, без чтения строки (вызывается из воркеров)"""
+    db = SessionLocal()
+    try:
+        db.execute(update(DeliveryModel).where(DeliveryModel.id == delivery_id).values(**values))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error updating delivery {delivery_id}: {e}")
+    finally:
+        db.close()
+
+
+def mark_delivery_started(delivery_id: int):
+    """Началась очередная попытка доставки"""
+    _update_delivery(
+        delivery_id,
+        state='in_progress',
+        attempts=DeliveryModel.attempts + 1,
+        started_at=func.coalesce(DeliveryModel.started_at, func.now()),
+    )
+
+
+def mark_delivery_retrying(delivery_id: int, error: str):
+    """Попытка не удалась, доставка будет повторена"""
+    _update_delivery(delivery_id, state='retrying', last_error=error)
+
+
+def mark_delivery_finished(delivery_id: int, success: bool, target_post_id: Optional[str] = None,
+                           error: Optional[str] = None):
+    """Доставка завершена: опубликовано или окончательно не удалось"""
+    values = {'state': 'delivered' if success else 'failed', 'finished_at': func.now()}
+    if success:
+        values['target_post_id'] = target_post_id
+    else:
+        values['last_error'] = error
+    _update_delivery(delivery_id, **values)
+
+
+def reset_failed_deliveries(db, post_id: int) -> List[DeliveryModel]:
+    """
+    Вернуть в очередь недоставленные доставки поста; возвращает их.
+    Кроме окончательно не удавшихся берутся и зависшие — в состоянии pending, in_progress
+    или retrying без изменений дольше delivery_stale_seconds (задача потерялась
+    до запуска или её воркер пропал).
+    Если старая попытка всё же жива, повторной публикации не даст ключ идемпотентности.
+    """
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=settings.delivery_stale_seconds)
+    last_change = func.coalesce(DeliveryModel.updated_at, DeliveryModel.started_at, DeliveryModel.created_at)
+    deliveries = db.query(DeliveryModel).filter(
+        DeliveryModel.post_id == post_id,
+        or_(
+            DeliveryModel.state == 'failed',
+            and_(DeliveryModel.state.in_(('pending', 'in_progress', 'retrying')), last_change < stale_before)
+        )
+    ).all()
+    for delivery in deliveries:
+        delivery.state = 'pending'
+        delivery.finished_at = None
+        # Отсчёт зависания заново: для pending состояние не меняется и onupdate не сработает
+        delivery.updated_at = func.now()
+    db.commit()
+    return deliveries
+
+
+def delivery_counts(db, account_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict[str, int]]:
+    """Количество доставок по аккаунтам и состояниям (один сгруппированный запрос по индексу)"""
+    query = db.query(
+        DeliveryModel.target_account_id, DeliveryModel.state, func.count(DeliveryModel.id)
+    )
+    if account_ids is not None:
+        query = query.filter(DeliveryModel.target_account_id.in_(list(account_ids)))
+
+    counts: Dict[int, Dict[str, int]] = {}
+    for account_id, state, count in query.group_by(DeliveryModel.target_account_id, DeliveryModel.state):
+        counts.setdefault(account_id, {})[state] = count
+    return counts
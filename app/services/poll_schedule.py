@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.config import settings
+from app.database import SessionLocal
+from app.models.social_account import SocialAccount as SocialAccountModel
+
+
+def update_posting_rate(rate: Optional[float], new_posts: int, elapsed_seconds: float) -> float:
+    """Обновить экспоненциально сглаженную частоту постов (постов в час)"""
+    elapsed_hours = max(elapsed_seconds, 1) / 3600
+    observed = new_posts / elapsed_hours
+    if rate is None:
+        return observed
+    alpha = settings.poll_rate_smoothing
+    return alpha * observed + (1 - alpha) * rate
+
+
+def advance_cursor(stored: Optional[str], cursor) -> str:
+    """
+    Новое значение курсора опроса. Числовой курсор (ID поста) не сдвигается назад:
+    Callback API и опрос могут прислать посты старее уже сохранённой позиции.
+    """
+    try:
+        return str(max(int(stored), int(cursor)))
+    except (TypeError, ValueError):
+        return str(cursor)
+
+
+def compute_poll_interval(current_interval: Optional[int], rate: float, new_posts: int) -> int:
+    """
+    Рассчитать следующий интервал опроса аккаунта.
+
+    Если в опросе нашлись новые посты — сразу возвращаемся к минимальному интервалу.
+    Иначе интервал растёт в poll_backoff_factor раз, но не выше интервала, при котором
+    за один опрос в среднем ожидается poll_target_posts_per_poll постов.
+    """
+    min_interval = settings.poll_min_interval_seconds
+    max_interval = settings.poll_max_interval_seconds
+
+    if new_posts > 0:
+        return min_interval
+
+    if rate > 0:
+        rate_interval = 3600 * settings.poll_target_posts_per_poll / rate
+    else:
+        rate_interval = max_interval
+
+    current_interval = current_interval or settings.poll_default_interval_seconds
+    interval = min(current_interval * settings.poll_backoff_factor, rate_interval)
+    return int(max(min_interval, min(interval, max_interval)))
+
+
+def record_poll_result(account_id: int, new_posts: int, polled_at: Optional[datetime] = None,
+                       cursor: Optional[str] = None):
+    """
+    Сохранить результат опроса и назначить время следующего опроса аккаунта.
+    Если передан cursor, он сохраняется как позиция, с которой продолжит следующий опрос
+    (числовой курсор — только если он новее сохранённого, см. advance_cursor).
+    """
+    polled_at = polled_at or datetime.now(timezone.utc)
+
+    db = SessionLocal()
+    try:
+        # Блокировка строки: опрос и Callback API могут обновлять курсор одновременно
+        account = db.query(SocialAccountModel).filter(
+            SocialAccountModel.id == account_id
+        ).with_for_update().first()
+        if not account:
+            return
+
+        if account.last_polled_at:
+            elapsed = (polled_at - account.last_polled_at).total_seconds()
+        else:
+            elapsed = account.poll_interval_seconds or settings.poll_default_interval_seconds
+
+        account.posting_rate = update_posting_rate(account.posting_rate, new_posts, elapsed)
+        account.poll_interval_seconds = compute_poll_interval(
+            account.poll_interval_seconds, account.posting_rate, new_posts
+        )
+        account.last_polled_at = polled_at
+        if cursor is not None:
+            account.poll_cursor = advance_cursor(account.poll_cursor, cursor)
+        account.next_poll_at = polled_at + timedelta(seconds=account.poll_interval_seconds)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Error recording poll result for account {account_id}: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,211 @@
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.core.security import encrypt_data, decrypt_data
+
+_DEAD_LETTERS_KEY = "crossposter:dlq"
+
+# Аренда хранит токен владельца; продлить и снять её может только он
+_RENEW_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Запись результата и снятие своей аренды одной операцией
+_COMPLETE_LUA = """
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+
+def source_key(platform: str, owner: str, post_id) -> str:
+    """
+    Идентификатор исходного поста: платформа, аккаунт/стена/чат источника и ID поста в нём.
+    ID постов уникальны только в пределах стены или чата, поэтому без источника
+    посты из разных каналов с одинаковым ID считались бы одним постом.
+    """
+    return f"{platform}:{owner}:{post_id}"
+
+
+def publish_key(post_data: Dict, target: str) -> str:
+    """
+    Ключ идемпотентности публикации: исходный пост + цель.
+    Исходный пост задаёт post_data['source_key'] (см. source_key) — его обязан передать
+    тот, кто ставит публикацию в очередь.
+    """
+    source = post_data.get('source_key')
+    if not source:
+        raise ValueError("post_data не содержит source_key — публикацию нельзя сделать идемпотентной")
+    return f"{source}:{target}"
+
+
+def retry_countdown(retries: int) -> float:
+    """Задержка перед повтором: экспоненциальная с ограничением и случайным разбросом (jitter)"""
+    delay = min(settings.publish_retry_backoff_max_seconds, settings.publish_retry_backoff_seconds * 2 ** retries)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class PublishLedger:
+    """
+    Журнал выполненных публикаций.
+
+    Перед публикацией воркер берёт аренду на ключ (SET NX с коротким истечением), чтобы
+    один и тот же пост в одну и ту же цель не публиковали параллельно. Пока публикация
+    идёт, фоновый поток продлевает аренду; аренда упавшего воркера истекает через
+    publish_lease_seconds, и повторно доставленная задача может её взять. После успеха
+    результат записывается вместе со снятием аренды. Повтор задачи с уже записанным
+    ключом возвращает сохранённый результат, не публикуя пост второй раз.
+    """
+
+    def __init__(self, ttl: int = None, lease: int = None):
+        self.ttl = ttl or settings.publish_record_ttl_seconds
+        self.lease_seconds = lease or settings.publish_lease_seconds
+
+    @staticmethod
+    def _done_key(key: str) -> str:
+        return f"crossposter:published:{key}"
+
+    @staticmethod
+    def _lease_key(key: str) -> str:
+        return f"crossposter:publishing:{key}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Результат уже выполненной публикации или None"""
+        data = get_redis().get(self._done_key(key))
+        return json.loads(data) if data else None
+
+    def claim(self, key: str) -> Optional[str]:
+        """Взять аренду на публикацию; возвращает токен аренды или None, если её держит другой воркер"""
+        token = str(uuid.uuid4())
+        if get_redis().set(self._lease_key(key), token, nx=True, ex=self.lease_seconds):
+            return token
+        return None
+
+    def renew(self, key: str, token: str) -> bool:
+        """Продлить свою аренду; False — аренда уже истекла или перешла к другому воркеру"""
+        return bool(get_redis().eval(_RENEW_LEASE_LUA, 1, self._lease_key(key), token, self.lease_seconds * 1000))
+
+    def complete(self, key: str, result: Dict, token: str):
+        """Записать успешную публикацию и снять свою аренду"""
+        get_redis().eval(
+            _COMPLETE_LUA, 2, self._done_key(key), self._lease_key(key),
+            token, json.dumps(result, default=str), self.ttl
+        )
+
+    def release(self, key: str, token: str):
+        """Снять свою аренду после неудачной попытки"""
+        get_redis().eval(_RELEASE_LEASE_LUA, 1, self._lease_key(key), token)
+
+    @contextmanager
+    def lease(self, key: str):
+        """
+        Аренда на время публикации: отдаёт токен (None, если аренду держит другой воркер),
+        продлевает её в фоне каждые publish_lease_seconds / 3 и снимает при выходе.
+        """
+        token = self.claim(key)
+        if token is None:
+            yield None
+            return
+
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self.lease_seconds / 3):
+                try:
+                    if not self.renew(key, token):
+                        print(f"Publish lease {key} was lost")
+                        return
+                except Exception as e:
+                    print(f"Error renewing publish lease {key}: {e}")
+
+        thread = threading.Thread(target=heartbeat, name="publish-lease", daemon=True)
+        thread.start()
+        try:
+            yield token
+        finally:
+            stopped.set()
+            thread.join()
+            self.release(key, token)
+
+
+class DeadLetterQueue:
+    """
+    Очередь публикаций, исчерпавших повторы.
+
+    Запись хранит имя задачи, ключ идемпотентности, ошибку и число попыток; аргументы
+    задачи (в них токены) хранятся зашифрованными. Записи можно просмотреть и поставить
+    обратно в Celery — повторная постановка безопасна благодаря ключу идемпотентности.
+    """
+
+    def push(self, task_name: str, args: List, kwargs: Dict, key: str, error: str, attempts: int):
+        entry = {
+            'id': str(uuid.uuid4()),
+            'task': task_name,
+            'idempotency_key': key,
+            'error': error,
+            'attempts': attempts,
+            'failed_at': time.time(),
+            'payload': encrypt_data(json.dumps({'args': list(args or []), 'kwargs': kwargs or {}}, default=str)),
+        }
+        get_redis().rpush(_DEAD_LETTERS_KEY, json.dumps(entry))
+
+    def peek(self, offset: int = 0, limit: int = 100) -> List[Dict]:
+        """Записи очереди без аргументов задачи"""
+        items = get_redis().lrange(_DEAD_LETTERS_KEY, offset, offset + limit - 1)
+        entries = []
+        for item in items:
+            entry = json.loads(item)
+            entry.pop('payload', None)
+            entries.append(entry)
+        return entries
+
+    def take(self, ids: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        Забрать записи из очереди для повторной постановки (все, если ids не указаны).
+        Возвращает записи с расшифрованными args и kwargs.
+        """
+        redis = get_redis()
+        if ids is None:
+            pipe = redis.pipeline(transaction=True)
+            pipe.lrange(_DEAD_LETTERS_KEY, 0, -1)
+            pipe.delete(_DEAD_LETTERS_KEY)
+            items, _ = pipe.execute()
+        else:
+            ids = set(ids)
+            items = []
+            for item in redis.lrange(_DEAD_LETTERS_KEY, 0, -1):
+                if json.loads(item)['id'] in ids and redis.lrem(_DEAD_LETTERS_KEY, 1, item):
+                    items.append(item)
+
+        entries = []
+        for item in items:
+            entry = json.loads(item)
+            entry.update(json.loads(decrypt_data(entry.pop('payload'))))
+            entries.append(entry)
+        return entries
+
+    def size(self) -> int:
+        return get_redis().llen(_DEAD_LETTERS_KEY)
+
+
+# Глобальные экземпляры
+publish_ledger = PublishLedger()
+dead_letters = DeadLetterQueue()
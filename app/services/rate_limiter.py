@@ -0,0 +1,109 @@
+import asyncio
+import time
+from typing import Optional
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+# Корзина токенов в Redis: KEYS[1] — hash (tokens, ts), KEYS[2] — пауза по подсказке платформы.
+# ARGV: скорость пополнения (токенов в секунду), ёмкость, сколько токенов нужно,
+# максимальное ожидание (мс). Время берётся у Redis, чтобы часы воркеров не влияли на лимит.
+# Возвращает {зарезервировано, сколько ждать в мс}: если токенов не хватает, они берутся
+# в долг и вызывающий ждёт ровно до момента, когда долг покроется; если ждать пришлось бы
+# дольше max_wait (или действует пауза), ничего не резервируется.
+_TOKEN_BUCKET_LUA = """
+local blocked = redis.call('PTTL', KEYS[2])
+if blocked > 0 then
+    return {0, blocked}
+end
+
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local rate = tonumber(ARGV[1]) / 1000
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens < requested then
+    wait = math.ceil((requested - tokens) / rate)
+    if wait > max_wait then
+        return {0, wait}
+    end
+end
+
+tokens = tokens - requested
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + wait + 1000)
+return {1, wait}
+"""
+
+
+class RateLimitExceeded(Exception):
+    """Дождаться разрешения на запрос за отведённое время не получится"""
+
+
+class RateLimiter:
+    """
+    Распределённый ограничитель частоты запросов (token bucket в Redis).
+
+    Лимит задаётся по ключу (платформа + токен + адресат) и общий для всех воркеров.
+    Корзина пополняется со скоростью rate / per токенов в секунду до ёмкости burst.
+    Запрос, которому не хватило токена, резервирует его и ждёт ровно столько, сколько
+    нужно до пополнения, а не получает ошибку от платформы. Подсказки платформ
+    (RetryAfter Telegram, ошибка 6 VK) превращаются в паузу block для всех воркеров.
+    """
+
+    def __init__(self, max_wait: int = None):
+        self.max_wait = max_wait or settings.rate_limit_max_wait_seconds
+        self._script = None
+
+    @staticmethod
+    def _keys(key: str):
+        return f"crossposter:ratelimit:{key}", f"crossposter:ratelimit:{key}:blocked"
+
+    def _try_acquire(self, key: str, rate: float, per: float, burst: Optional[float]):
+        """Один вызов скрипта: (зарезервировано ли, сколько ждать в секундах)"""
+        if self._script is None:
+            self._script = get_redis().register_script(_TOKEN_BUCKET_LUA)
+        reserved, wait_ms = self._script(
+            keys=self._keys(key),
+            args=[rate / per, burst or rate, 1, int(self.max_wait * 1000)]
+        )
+        return bool(reserved), wait_ms / 1000
+
+    def acquire(self, key: str, rate: float, per: float = 1.0, burst: Optional[float] = None):
+        """Дождаться разрешения на запрос (синхронно)"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            reserved, wait = self._try_acquire(key, rate, per, burst)
+            if not reserved and time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"Лимит запросов {key} не освободится за {self.max_wait} с")
+            if wait > 0:
+                time.sleep(wait)
+            if reserved:
+                return
+
+    async def acquire_async(self, key: str, rate: float, per: float = 1.0, burst: Optional[float] = None):
+        """Дождаться разрешения на запрос, не блокируя event loop"""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            reserved, wait = await asyncio.to_thread(self._try_acquire, key, rate, per, burst)
+            if not reserved and time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(f"Лимит запросов {key} не освободится за {self.max_wait} с")
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if reserved:
+                return
+
+    def block(self, key: str, seconds: float):
+        """Приостановить запросы по ключу на seconds секунд (по подсказке платформы)"""
+        get_redis().set(self._keys(key)[1], 1, px=max(1, int(seconds * 1000)))
+
+
+# Общий ограничитель процесса
+rate_limiter = RateLimiter()
@@ -0,0 +1,60 @@
+import time
+from typing import Iterable, List
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+
+class SeenPostIndex:
+    """
+    Индекс уже обработанных постов по каждому источнику.
+
+    Для каждого аккаунта-источника хранится sorted set в Redis: элемент — ID поста,
+    score — время, когда пост был впервые замечен. ZADD NX атомарен, поэтому
+    из нескольких воркеров, увидевших один и тот же пост, «забирает» его только один.
+    Размер множества ограничен max_size последними постами, а ключ живёт ttl секунд
+    с момента последнего опроса.
+    """
+
+    def __init__(self, max_size: int = None, ttl: int = None):
+        self.max_size = max_size or settings.seen_posts_max_per_account
+        self.ttl = ttl or settings.seen_posts_ttl_seconds
+
+    @staticmethod
+    def _key(platform: str, account_id: int) -> str:
+        return f"crossposter:seen:{platform}:{account_id}"
+
+    def claim_new(self, platform: str, account_id: int, post_ids: Iterable) -> List[str]:
+        """
+        Отметить посты как увиденные и вернуть ID только тех, что раньше не встречались.
+        Порядок входных ID сохраняется.
+        """
+        post_ids = [str(post_id) for post_id in post_ids if post_id is not None]
+        if not post_ids:
+            return []
+
+        key = self._key(platform, account_id)
+        now = time.time()
+
+        pipe = get_redis().pipeline(transaction=True)
+        for post_id in post_ids:
+            pipe.zadd(key, {post_id: now}, nx=True)
+        # Оставляем только самые свежие max_size записей
+        pipe.zremrangebyrank(key, 0, -self.max_size - 1)
+        pipe.expire(key, self.ttl)
+        added = pipe.execute()[:len(post_ids)]
+
+        return [post_id for post_id, is_new in zip(post_ids, added) if is_new]
+
+    def is_seen(self, platform: str, account_id: int, post_id) -> bool:
+        """Проверить, обрабатывался ли пост раньше"""
+        return get_redis().zscore(self._key(platform, account_id), str(post_id)) is not None
+
+    def forget(self, platform: str, account_id: int, post_ids: Iterable):
+        """Снять отметку (например, если обработка поста не удалась и его нужно повторить)"""
+        post_ids = [str(post_id) for post_id in post_ids]
+        if post_ids:
+            get_redis().zrem(self._key(platform, account_id), *post_ids)
+
+
+# Глобальный экземпляр индекса
+seen_post_index = SeenPostIndex()
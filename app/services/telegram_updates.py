@@ -0,0 +1,212 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+from telegram.error import TelegramError
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.social.telegram_client import TelegramClient, get_telegram_client
+
+logger = logging.getLogger(__name__)
+
+
+def _prefix(bot_id: str) -> str:
+    return f"crossposter:tg:{bot_id}"
+
+
+def _chat_key(bot_id: str, chat_id) -> str:
+    return f"{_prefix(bot_id)}:chat:{chat_id}"
+
+
+def get_chat_account(bot_id: str, chat_id) -> Optional[int]:
+    """ID аккаунта-источника, зарегистрированного для чата бота (без обращения к БД)"""
+    account_id = get_redis().hget(f"{_prefix(bot_id)}:chats", str(chat_id))
+    return int(account_id) if account_id else None
+
+
+def uses_webhook(bot_id: str) -> bool:
+    """Переведён ли бот на вебхук (тогда getUpdates для него недоступен — Telegram ответит 409)"""
+    return settings.telegram_ingest_mode == 'webhook' or bool(get_redis().exists(f"{_prefix(bot_id)}:webhook"))
+
+
+def push_chat_posts(bot_id: str, chat_id, posts: List[Dict]):
+    """Положить посты в очередь чата"""
+    if not posts:
+        return
+    key = _chat_key(bot_id, chat_id)
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.rpush(key, *[json.dumps(post) for post in posts])
+    pipe.ltrim(key, -settings.telegram_chat_queue_max, -1)
+    pipe.expire(key, settings.telegram_chat_queue_ttl_seconds)
+    pipe.execute()
+
+
+def drain_chat_posts(bot_id: str, chat_id) -> List[Dict]:
+    """Забрать все накопившиеся посты чата (атомарно, без дублей между воркерами)"""
+    key = _chat_key(bot_id, chat_id)
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    items, _ = pipe.execute()
+    return [json.loads(item) for item in items]
+
+
+class TelegramUpdateDispatcher:
+    """
+    Единственный потребитель getUpdates для одного бота.
+
+    Бот может быть источником сразу для нескольких каналов, а getUpdates возвращает
+    обновления всех чатов вперемешку и не допускает параллельных вызовов. Поэтому
+    опрос идёт под Redis-блокировкой на токен, offset хранится в Redis, а полученные
+    посты раскладываются по очередям (Redis-спискам) зарегистрированных чатов.
+    Задачи проверки каналов забирают посты из своей очереди, не обращаясь к Telegram.
+    """
+
+    def __init__(self, bot_token: str):
+        self.client = get_telegram_client(bot_token)
+        # ID бота (часть токена до «:») не секретен и стабилен — используем его в ключах
+        self.bot_id = bot_token.split(':', 1)[0]
+
+    @property
+    def _prefix(self) -> str:
+        return _prefix(self.bot_id)
+
+    def register_chat(self, chat_id, account_id: Optional[int] = None):
+        """Подписать чат на раздачу обновлений этого бота"""
+        get_redis().hset(f"{self._prefix}:chats", str(chat_id), account_id or '')
+
+    def set_webhook_mode(self, enabled: bool):
+        """Отметить, что обновления бота приходят на вебхук и опрашивать его не нужно"""
+        if enabled:
+            get_redis().set(f"{self._prefix}:webhook", 1)
+        else:
+            get_redis().delete(f"{self._prefix}:webhook")
+
+    def drain(self, chat_id) -> List[Dict]:
+        """Забрать все накопившиеся посты чата"""
+        return drain_chat_posts(self.bot_id, chat_id)
+
+    async def poll_once(self, timeout: int = 0) -> Optional[Dict[str, int]]:
+        """
+        Один вызов getUpdates с сохранённым offset.
+
+        Возвращает количество новых постов по чатам, которые получили обновления,
+        или None, если бот уже опрашивает другой процесс.
+        """
+        redis = get_redis()
+        lock = redis.lock(f"{self._prefix}:lock", timeout=timeout + 30)
+        if not lock.acquire(blocking=False):
+            return None
+
+        try:
+            offset = redis.get(f"{self._prefix}:offset")
+            try:
+                updates = await self.client.bot.get_updates(
+                    offset=int(offset) if offset else None,
+                    timeout=timeout,
+                    allowed_updates=['message', 'channel_post'],
+                )
+            except TelegramError as e:
+                logger.error(f"Error getting Telegram updates for bot {self.bot_id}: {e}")
+                return {}
+
+            if not updates:
+                return {}
+
+            chats = set(redis.hkeys(f"{self._prefix}:chats"))
+            per_chat: Dict[str, List[Dict]] = {}
+            for update in updates:
+                message = update.channel_post or update.message
+                if not message or str(message.chat_id) not in chats:
+                    continue
+                post = TelegramClient.message_to_post(message)
+                post['date'] = int(post['date'].timestamp()) if post['date'] else None
+                per_chat.setdefault(str(message.chat_id), []).append(post)
+
+            # Очереди чатов и новый offset сохраняются одной транзакцией: если процесс упадёт
+            # раньше, Telegram отдаст те же обновления повторно
+            pipe = redis.pipeline(transaction=True)
+            for chat_id, posts in per_chat.items():
+                key = _chat_key(self.bot_id, chat_id)
+                pipe.rpush(key, *[json.dumps(post) for post in posts])
+                pipe.ltrim(key, -settings.telegram_chat_queue_max, -1)
+                pipe.expire(key, settings.telegram_chat_queue_ttl_seconds)
+            pipe.set(f"{self._prefix}:offset", updates[-1].update_id + 1)
+            pipe.execute()
+
+            return {chat_id: len(posts) for chat_id, posts in per_chat.items()}
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                # Блокировка могла истечь за время длинного опроса
+                pass
+
+
+async def _listen_bot(bot_token: str, accounts: Dict[str, int]):
+    """Длинный опрос одного бота; по каждому обновлённому чату сразу ставится задача проверки"""
+    from app.tasks.monitoring import check_telegram_posts
+
+    dispatcher = TelegramUpdateDispatcher(bot_token)
+    for chat_id, account_id in accounts.items():
+        dispatcher.register_chat(chat_id, account_id)
+
+    while True:
+        if uses_webhook(dispatcher.bot_id):
+            logger.info(f"Bot {dispatcher.bot_id} switched to webhook, stopping its listener")
+            return
+        try:
+            updated = await dispatcher.poll_once(timeout=settings.telegram_long_poll_timeout)
+        except Exception as e:
+            logger.error(f"Telegram listener error for bot {dispatcher.bot_id}: {e}")
+            await asyncio.sleep(5)
+            continue
+
+        if updated is None:
+            # Бота опрашивает другой процесс
+            await asyncio.sleep(settings.telegram_long_poll_timeout)
+            continue
+
+        for chat_id in updated:
+            account_id = accounts.get(chat_id)
+            if account_id:
+                check_telegram_posts.delay(account_id, bot_token, chat_id)
+
+
+async def run_listeners(bot_accounts: Optional[Dict[str, Dict[str, int]]] = None):
+    """
+    Запустить длинный опрос для всех ботов активных Telegram-источников.
+    bot_accounts — bot_token -> {chat_id: account_id}; по умолчанию читается из БД.
+    Боты, переведённые на вебхук, не опрашиваются.
+    """
+    if bot_accounts is None:
+        from app.database import SessionLocal
+        from app.models.social_account import SocialAccount as SocialAccountModel
+
+        bot_accounts = {}
+        db = SessionLocal()
+        try:
+            accounts = db.query(SocialAccountModel).filter(
+                SocialAccountModel.platform == 'telegram',
+                SocialAccountModel.is_active == True
+            ).all()
+            for account in accounts:
+                chat_id = (account.settings or {}).get('chat_id')
+                if chat_id and (account.settings or {}).get('ingest_mode') != 'webhook':
+                    bot_accounts.setdefault(account.access_token, {})[str(chat_id)] = account.id
+        finally:
+            db.close()
+
+    bot_accounts = {
+        bot_token: accounts for bot_token, accounts in bot_accounts.items()
+        if not uses_webhook(bot_token.split(':', 1)[0])
+    }
+    logger.info(f"Starting Telegram listeners for {len(bot_accounts)} bot(s)")
+    await asyncio.gather(*[
+        _listen_bot(bot_token, accounts) for bot_token, accounts in bot_accounts.items()
+    ])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_listeners())
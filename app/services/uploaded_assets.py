@@ -0,0 +1,69 @@
+from typing import Dict, Iterable, Optional
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+
+class UploadedAssetRegistry:
+    """
+    Реестр медиафайлов, уже загруженных на платформы.
+
+    По хэшу содержимого файла, платформе и области видимости (scope) хранится
+    идентификатор загруженного файла на стороне платформы: file_id Telegram (scope —
+    бот) или attachment-строка VK «photo<owner>_<id>» (scope — токен и сообщество).
+    Повторная отправка того же файла в ту же область становится вызовом API
+    без загрузки байтов. Записи живут ttl секунд; если платформа отвергла
+    идентификатор, запись удаляется через forget и файл загружается заново.
+    """
+
+    def __init__(self, ttl: int = None):
+        self.ttl = ttl or settings.uploaded_assets_ttl_seconds
+
+    @staticmethod
+    def _key(platform: str, scope: str, content_hash: str) -> str:
+        return f"crossposter:asset:{platform}:{scope}:{content_hash}"
+
+    @staticmethod
+    def _handle_key(platform: str, scope: str, handle: str) -> str:
+        return f"crossposter:asset:{platform}:{scope}:handle:{handle}"
+
+    def get(self, platform: str, scope: str, content_hash: str) -> Optional[str]:
+        """Идентификатор файла на платформе или None, если файл туда не загружался"""
+        return get_redis().get(self._key(platform, scope, content_hash))
+
+    def get_many(self, platform: str, scope: str, content_hashes: Iterable[str]) -> Dict[str, str]:
+        """Найти сразу несколько файлов (один MGET); возвращает только найденные"""
+        content_hashes = list(dict.fromkeys(content_hashes))
+        if not content_hashes:
+            return {}
+        handles = get_redis().mget([self._key(platform, scope, h) for h in content_hashes])
+        return {h: handle for h, handle in zip(content_hashes, handles) if handle}
+
+    def remember(self, platform: str, scope: str, handles: Dict[str, str]):
+        """Сохранить идентификаторы загруженных файлов: хэш содержимого -> идентификатор"""
+        if not handles:
+            return
+        pipe = get_redis().pipeline(transaction=False)
+        for content_hash, handle in handles.items():
+            pipe.set(self._key(platform, scope, content_hash), handle, ex=self.ttl)
+            # Обратная ссылка — чтобы забыть запись, зная только идентификатор
+            pipe.set(self._handle_key(platform, scope, handle), content_hash, ex=self.ttl)
+        pipe.execute()
+
+    def forget(self, platform: str, scope: str, content_hashes: Iterable[str]):
+        """Удалить записи, которые платформа перестала принимать"""
+        keys = [self._key(platform, scope, h) for h in content_hashes]
+        if keys:
+            get_redis().delete(*keys)
+
+    def forget_handles(self, platform: str, scope: str, handles: Iterable[str]):
+        """Удалить записи по идентификаторам на платформе (например, по attachment-строкам)"""
+        handle_keys = [self._handle_key(platform, scope, handle) for handle in handles]
+        if not handle_keys:
+            return
+        content_hashes = [h for h in get_redis().mget(handle_keys) if h]
+        self.forget(platform, scope, content_hashes)
+        get_redis().delete(*handle_keys)
+
+
+# Глобальный экземпляр реестра
+uploaded_assets = UploadedAssetRegistry()
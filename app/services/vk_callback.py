@@ -0,0 +1,20 @@
+import json
+from typing import Dict, Optional
+from app.core.redis_client import get_redis
+
+# group_id -> {"account_id": ..., "confirmation_code": ...}
+_GROUPS_KEY = "crossposter:vk:callback:groups"
+
+
+def register_callback_group(group_id: int, account_id: int, confirmation_code: str):
+    """Запомнить сообщество, подключённое к Callback API"""
+    get_redis().hset(_GROUPS_KEY, str(group_id), json.dumps({
+        'account_id': account_id,
+        'confirmation_code': confirmation_code,
+    }))
+
+
+def get_callback_group(group_id) -> Optional[Dict]:
+    """Данные подключённого сообщества (без обращения к БД) или None"""
+    data = get_redis().hget(_GROUPS_KEY, str(group_id))
+    return json.loads(data) if data else None
@@ -0,0 +1,63 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+
+def credentials_key(*parts: str) -> str:
+    """Ключ пула по учетным данным (в памяти храним хэш, а не сам токен)"""
+    return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+class ClientPool:
+    """
+    Пул клиентов соцсетей в пределах процесса.
+
+    Клиенты переиспользуются по ключу учетных данных, пока не простоят дольше
+    idle_ttl секунд; при переполнении вытесняется давно не использованный (LRU).
+    Создание клиента (логин, загрузка discovery-документа и т.п.) выполняется
+    вне блокировки, чтобы медленный логин не задерживал другие потоки.
+    """
+
+    def __init__(self, factory: Callable, max_size: int, idle_ttl: int):
+        self._factory = factory
+        self._max_size = max_size
+        self._idle_ttl = idle_ttl
+        self._clients = OrderedDict()  # key -> (client, last_used)
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if now - last_used <= self._idle_ttl:
+                break
+            del self._clients[key]
+
+    def get(self, key: str, *args, **kwargs):
+        """Получить клиента из пула или создать нового через factory(*args, **kwargs)"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry:
+                self._clients[key] = (entry[0], now)
+                self._clients.move_to_end(key)
+                return entry[0]
+
+        client = self._factory(*args, **kwargs)
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry:
+                # Другой поток успел создать клиента раньше
+                return entry[0]
+            self._clients[key] = (client, now)
+            while len(self._clients) > self._max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def discard(self, key: str):
+        """Убрать клиента из пула (например, после ошибки авторизации)"""
+        with self._lock:
+            self._clients.pop(key, None)
@@ -1,6 +1,12 @@
 from instagrapi import Client
+from instagrapi.exceptions import LoginRequired
 from typing import Dict, List, Optional
+import json
 import os
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.core.security import encrypt_data, decrypt_data
+from app.social.client_pool import ClientPool, credentials_key
 
 class InstagramClient:
     def __init__(self, username: str, password: str):
@@ -9,12 +15,59 @@ class InstagramClient:
         self.client = Client()
         self.login()
     
+    def _session_key(self) -> str:
+        return f"crossposter:ig:session:{credentials_key(self.username)}"
+
+    def _load_session(self) -> Optional[Dict]:
+        """Загрузить сохранённую сессию instagrapi (хранится в Redis в зашифрованном виде)"""
+        try:
+            data = get_redis().get(self._session_key())
+            return json.loads(decrypt_data(data)) if data else None
+        except Exception as e:
+            print(f"Error loading Instagram session: {e}")
+            return None
+
+    def _save_session(self):
+        try:
+            data = encrypt_data(json.dumps(self.client.get_settings()))
+            get_redis().set(self._session_key(), data, ex=settings.instagram_session_ttl_seconds)
+        except Exception as e:
+            print(f"Error saving Instagram session: {e}")
+
     def login(self):
-        """Авторизация в Instagram"""
+        """
+        Авторизация в Instagram.
+        Сначала пробуем восстановить сохранённую сессию — это избавляет от полного логина
+        и лишних проверок (challenge) со стороны Instagram. При неудачном логине
+        выбрасывает исключение, чтобы нерабочий клиент не попал в пул.
+        """
+        session = self._load_session()
+        if session:
+            try:
+                self.client.set_settings(session)
+                self.client.login(self.username, self.password)
+                # С восстановленной сессией login() не обращается к Instagram —
+                # проверяем сессию дешёвым запросом
+                self.client.get_timeline_feed()
+                self._save_session()
+                return
+            except Exception as e:
+                print(f"Saved Instagram session is not valid, logging in again: {e}")
+                get_redis().delete(self._session_key())
+                # Сохраняем идентификаторы устройства, чтобы новый логин не выглядел как новое устройство
+                self.client = Client()
+                self.client.set_uuids(session.get('uuids', {}))
+
         try:
             self.client.login(self.username, self.password)
         except Exception as e:
             print(f"Error logging into Instagram: {e}")
+            raise
+        self._save_session()
+
+    def _discard(self):
+        """Убрать клиента из пула процесса: сессия отозвана, следующий вызов залогинится заново"""
+        _instagram_pool.discard(credentials_key(self.username, self.password))
     
     def get_latest_posts(self, user_id: str, count: int = 10) -> List[Dict]:
         """Получить последние посты из Instagram"""
@@ -34,6 +87,10 @@ class InstagramClient:
                 posts.append(post)
             
             return posts
+        except LoginRequired:
+            # Не выдаём отозванную сессию за «новых постов нет»
+            self._discard()
+            raise
         except Exception as e:
             print(f"Error getting Instagram posts: {e}")
             return []
@@ -49,11 +106,21 @@ class InstagramClient:
         except Exception as e:
             error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации в Instagram"
             print(f"Error posting photo to Instagram: {error_message}")
+            if isinstance(e, LoginRequired):
+                self._discard()
             return {"error": error_message}
     
     def post_video(self, video_path: str, caption: str, thumbnail_path: Optional[str] = None) -> Dict:
-        """Опубликовать видео в Instagram"""
+        """Опубликовать видео в Instagram (перекодированное под требования Instagram при необходимости)"""
         try:
+            from app.utils.media_transcoder import VideoRejected, prepare_video
+
+            try:
+                video_path = prepare_video(video_path, 'instagram')
+            except VideoRejected as e:
+                # Повтор не поможет — видео не подходит Instagram
+                print(f"Video rejected for Instagram: {e}")
+                return {"error": str(e), "retryable": False}
             if thumbnail_path:
                 result = self.client.video_upload(video_path, caption, thumbnail=thumbnail_path)
             else:
@@ -66,6 +133,8 @@ class InstagramClient:
         except Exception as e:
             error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации видео в Instagram"
             print(f"Error posting video to Instagram: {error_message}")
+            if isinstance(e, LoginRequired):
+                self._discard()
             return {"error": error_message}
 
     def validate_token(self) -> Dict:
@@ -93,4 +162,17 @@ class InstagramClient:
                     "valid": False,
                     "error": "Ошибка проверки учетных данных",
                     "message": error_message
-                }
\ No newline at end of file
+                }
+
+
+# Залогиненные клиенты переиспользуются в пределах процесса
+_instagram_pool = ClientPool(
+    InstagramClient,
+    max_size=settings.client_pool_max_size,
+    idle_ttl=settings.client_pool_idle_seconds
+)
+
+
+def get_instagram_client(username: str, password: str) -> InstagramClient:
+    """Получить залогиненный клиент Instagram из пула процесса"""
+    return _instagram_pool.get(credentials_key(username, password), username, password)
@@ -1,5 +1,7 @@
 from pinterest import Pinterest
 from typing import Dict, List, Optional
+from app.core.config import settings
+from app.social.client_pool import ClientPool, credentials_key
 
 class PinterestClient:
     def __init__(self, access_token: str):
@@ -61,4 +63,16 @@ class PinterestClient:
                     "valid": False,
                     "error": "Ошибка проверки токена",
                     "message": error_message
-                }
\ No newline at end of file
+                }
+
+
+_pinterest_pool = ClientPool(
+    PinterestClient,
+    max_size=settings.client_pool_max_size,
+    idle_ttl=settings.client_pool_idle_seconds
+)
+
+
+def get_pinterest_client(access_token: str) -> PinterestClient:
+    """Получить клиент Pinterest из пула процесса"""
+    return _pinterest_pool.get(credentials_key(access_token), access_token)
@@ -1,12 +1,109 @@
-from telegram import Bot
-from telegram.error import TelegramError
+from telegram import Bot, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from contextlib import ExitStack
 from typing import Dict, List, Optional
+from urllib.parse import urlsplit
 import asyncio
+import json
+import math
+import os
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.services.rate_limiter import rate_limiter
+from app.services.uploaded_assets import uploaded_assets
+from app.social.client_pool import ClientPool, credentials_key
+from app.utils.media_transcoder import VideoRejected, prepare_video_async
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+# Максимум элементов в одном альбоме (sendMediaGroup)
+MEDIA_GROUP_LIMIT = 10
+
+
+def is_url(item: str) -> bool:
+    return item.startswith(('http://', 'https://'))
+
+
+def balanced_chunks(items: List, limit: int) -> List[List]:
+    """
+    Разбить список на наименьшее число частей не больше limit элементов с почти равными
+    размерами: 11 элементов — 6 и 5, а не 10 и 1 (в альбоме должно быть от 2 элементов).
+    """
+    count = math.ceil(len(items) / limit)
+    size, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def media_kind(item: str) -> str:
+    """Тип медиа по расширению URL или файла: photo, video или document (неизвестный)"""
+    path = (urlsplit(item).path if is_url(item) else item).lower()
+    if path.endswith(PHOTO_EXTENSIONS):
+        return 'photo'
+    if path.endswith(VIDEO_EXTENSIONS):
+        return 'video'
+    return 'document'
+
+
+class RateLimitedBot(Bot):
+    """
+    Bot, все запросы которого проходят через общие для воркеров лимиты: на бота
+    (rate_limit_telegram_bot_per_second) и для отправки — на чат
+    (rate_limit_telegram_chat_per_minute). На RetryAfter ключ ставится на паузу
+    указанной длительности для всех воркеров, и запрос повторяется.
+    """
+
+    async def _do_post(self, endpoint: str, data: Dict, **kwargs):
+        if endpoint == 'getUpdates':
+            # Длинный опрос не расходует лимит на отправку
+            return await super()._do_post(endpoint=endpoint, data=data, **kwargs)
+
+        bot_key = f"tg:{self.token.split(':', 1)[0]}"
+        chat_id = data.get('chat_id') if endpoint.startswith(('send', 'copy', 'forward')) else None
+        chat_key = f"{bot_key}:chat:{chat_id}" if chat_id is not None else None
+
+        for attempt in range(settings.rate_limit_telegram_retries + 1):
+            await rate_limiter.acquire_async(bot_key, settings.rate_limit_telegram_bot_per_second)
+            if chat_key:
+                await rate_limiter.acquire_async(
+                    chat_key, settings.rate_limit_telegram_chat_per_minute, per=60
+                )
+            try:
+                return await super()._do_post(endpoint=endpoint, data=data, **kwargs)
+            except RetryAfter as e:
+                if attempt == settings.rate_limit_telegram_retries:
+                    raise
+                print(f"Telegram asked to retry {endpoint} in {e.retry_after}s")
+                rate_limiter.block(chat_key or bot_key, e.retry_after)
+
 
 class TelegramClient:
     def __init__(self, bot_token: str):
         self.bot_token = bot_token
-        self.bot = Bot(token=bot_token)
+        self._bot = None
+        self._bot_loop = None
+        # ID бота (часть токена до «:») — область реестра загруженных файлов
+        self.bot_id = bot_token.split(':', 1)[0]
+
+    @property
+    def bot(self) -> Bot:
+        """
+        Экземпляр Bot для текущего event loop.
+        Пул соединений httpx внутри Bot привязан к loop, в котором он создан, поэтому
+        клиент из пула, вызванный из другого loop, создаёт Bot заново.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._bot is None or (loop is not None and self._bot_loop is not loop):
+            self._bot = RateLimitedBot(token=self.bot_token)
+            self._bot_loop = loop
+        return self._bot
 
     async def get_latest_posts(self, chat_id: str, limit: int = 10) -> List[Dict]:
         """
@@ -28,24 +125,7 @@ class TelegramClient:
                 if chat_id and str(message.chat_id) != str(chat_id):
                     continue
 
-                post = {
-                    'id': message.message_id,
-                    'text': message.text or message.caption or '',
-                    'date': message.date,
-                    'media': [],
-                    'media_url': None,
-                }
-
-                # Проверка на наличие медиа
-                if message.photo:
-                    # Берём фото наибольшего размера
-                    largest_photo = max(message.photo, key=lambda p: p.file_size or 0)
-                    post['media'] = [largest_photo.file_id]
-                    post['media_url'] = largest_photo.file_id
-                elif message.video:
-                    post['media'] = [message.video.file_id]
-                    post['media_url'] = message.video.file_id
-
+                post = self.message_to_post(message)
                 posts.append(post)
 
             return posts
@@ -53,75 +133,237 @@ class TelegramClient:
             print(f"Error getting Telegram posts: {e}")
             return []
 
-    async def post_to_channel(self, chat_id: str, text: str, media: Optional[List[str]] = None) -> Dict:
-        """Опубликовать пост в Telegram канал"""
-        try:
-            result = None
-
-            if media:
-                # Публикация с медиа — обрабатываем только первое медиа
-                media_item = media[0]
-
-                if media_item.startswith(('http://', 'https://')):
-                    # Это URL — скачиваем файл локально для отправки
-                    import uuid
-                    from app.utils.media_downloader import download_media, get_file_extension
-
-                    file_extension = get_file_extension(media_item)
-                    temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-
-                    downloaded_path = download_media(media_item, temp_filename)
-                    if downloaded_path:
-                        with open(downloaded_path, 'rb') as f:
-                            if media_item.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                                result = await self.bot.send_photo(chat_id=chat_id, photo=f, caption=text)
-                            elif media_item.lower().endswith(('.mp4', '.mov', '.avi')):
-                                result = await self.bot.send_video(chat_id=chat_id, video=f, caption=text)
-                            else:
-                                result = await self.bot.send_document(chat_id=chat_id, document=f, caption=text)
-                        # Удаляем временный файл после отправки
-                        import os
-                        try:
-                            os.unlink(downloaded_path)
-                        except OSError:
-                            pass
-                    else:
-                        # Если не удалось скачать, пробуем отправить URL напрямую
-                        if media_item.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                            result = await self.bot.send_photo(chat_id=chat_id, photo=media_item, caption=text)
-                        elif media_item.lower().endswith(('.mp4', '.mov', '.avi')):
-                            result = await self.bot.send_video(chat_id=chat_id, video=media_item, caption=text)
-                        else:
-                            result = await self.bot.send_document(chat_id=chat_id, document=media_item, caption=text)
-
-                elif media_item.startswith('/tmp/') or media_item.startswith('./'):
-                    # Это локальный файл
-                    with open(media_item, 'rb') as f:
-                        if media_item.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                            result = await self.bot.send_photo(chat_id=chat_id, photo=f, caption=text)
-                        elif media_item.lower().endswith(('.mp4', '.mov', '.avi')):
-                            result = await self.bot.send_video(chat_id=chat_id, video=f, caption=text)
-                        else:
-                            result = await self.bot.send_document(chat_id=chat_id, document=f, caption=text)
-                else:
-                    # Это file_id или другой формат
-                    if media_item.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        result = await self.bot.send_photo(chat_id=chat_id, photo=media_item, caption=text)
-                    elif media_item.endswith(('.mp4', '.mov', '.avi')):
-                        result = await self.bot.send_video(chat_id=chat_id, video=media_item, caption=text)
-                    else:
-                        result = await self.bot.send_document(chat_id=chat_id, document=media_item, caption=text)
-            else:
+    @staticmethod
+    def message_to_post(message) -> Dict:
+        """Преобразовать сообщение Telegram в словарь поста"""
+        post = {
+            'id': message.message_id,
+            'text': message.text or message.caption or '',
+            'date': message.date,
+            'media': [],
+            'media_url': None,
+        }
+
+        # Проверка на наличие медиа
+        if message.photo:
+            # Берём фото наибольшего размера
+            largest_photo = max(message.photo, key=lambda p: p.file_size or 0)
+            post['media'] = [largest_photo.file_id]
+            post['media_url'] = largest_photo.file_id
+        elif message.video:
+            post['media'] = [message.video.file_id]
+            post['media_url'] = message.video.file_id
+
+        return post
+
+    async def post_to_channel(self, chat_id: str, text: str, media: Optional[List[str]] = None,
+                              progress_key: Optional[str] = None) -> Dict:
+        """
+        Опубликовать пост в Telegram канал.
+
+        Элементы media — URL, пути к локальным файлам или file_id. Несколько фото и видео
+        уходят альбомами (send_media_group, от 2 до 10 штук в альбоме, подпись у первого).
+        URL фото передаются Telegram как есть — он скачивает их сам; скачиваем и загружаем
+        файл только если Telegram не смог его получить или тип по URL не определить.
+        Видео скачиваются и при необходимости перекодируются под требования Telegram.
+
+        Пост из нескольких сообщений отправляется по шагам. С progress_key уже отправленные
+        шаги запоминаются в Redis, и повторный вызов с тем же ключом (повтор задачи)
+        отправляет только оставшиеся. При ошибке в ответе есть message_ids уже отправленных.
+        """
+        if not media:
+            try:
                 # Публикация только текста
                 result = await self.bot.send_message(chat_id=chat_id, text=text)
+                return {
+                    'message_id': result.message_id,
+                    'date': result.date,
+                }
+            except TelegramError as e:
+                error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации в Telegram"
+                print(f"Error posting to Telegram: {error_message}")
+                return {"error": error_message}
+
+        kinds = [media_kind(item) for item in media]
+        if len(media) == 1:
+            steps = [(self._send_single, media, kinds)]
+        elif 'document' in kinds and len(set(kinds)) > 1:
+            # Документы нельзя смешивать в одном альбоме с фото и видео — шлём по одному
+            steps = [(self._send_single, [item], [kind]) for item, kind in zip(media, kinds)]
+        else:
+            steps = [
+                (self._send_album, [media[i] for i in chunk], [kinds[i] for i in chunk])
+                for chunk in balanced_chunks(list(range(len(media))), MEDIA_GROUP_LIMIT)
+            ]
+
+        progress_redis_key = f"crossposter:tg:progress:{progress_key}" if progress_key else None
+        done = {}
+        if progress_redis_key:
+            done = {int(step): json.loads(sent) for step, sent in get_redis().hgetall(progress_redis_key).items()}
 
+        sent_steps = []
+        try:
+            for index, (send, items, step_kinds) in enumerate(steps):
+                if index in done:
+                    sent_steps.append(done[index])
+                    continue
+                result = await self._send_with_fallback(
+                    send, chat_id, items, step_kinds, text if index == 0 else None
+                )
+                messages = result if isinstance(result, list) else [result]
+                sent = {
+                    'message_ids': [message.message_id for message in messages],
+                    'date': messages[0].date.isoformat(),
+                }
+                sent_steps.append(sent)
+                if progress_redis_key:
+                    pipe = get_redis().pipeline()
+                    pipe.hset(progress_redis_key, index, json.dumps(sent))
+                    pipe.expire(progress_redis_key, settings.publish_record_ttl_seconds)
+                    pipe.execute()
+        except (TelegramError, VideoRejected) as e:
+            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации в Telegram"
+            print(f"Error posting to Telegram after {len(sent_steps)} of {len(steps)} messages: {error_message}")
             return {
-                'message_id': result.message_id,
-                'date': result.date,
+                "error": error_message,
+                "message_ids": [message_id for sent in sent_steps for message_id in sent['message_ids']],
+                # Видео, не подходящее Telegram, при повторе не станет подходящим
+                "retryable": not isinstance(e, VideoRejected),
             }
+
+        if progress_redis_key:
+            get_redis().delete(progress_redis_key)
+
+        message_ids = [message_id for sent in sent_steps for message_id in sent['message_ids']]
+        return {
+            'message_id': message_ids[0],
+            'date': sent_steps[0]['date'],
+            'message_ids': message_ids,
+        }
+
+    async def _send_with_fallback(self, send, chat_id: str, items: List[str], kinds: List[str],
+                                  caption: Optional[str]):
+        """
+        Отправить медиа с откатом на загрузку файлов.
+
+        Сначала URL передаются как есть, а файлы, уже загружавшиеся этим ботом, — по file_id
+        из реестра загруженных файлов. Если Telegram отверг сохранённый file_id, запись
+        забывается и файлы загружаются заново; если не смог скачать URL — скачиваем сами.
+        """
+        upload_urls = False
+        use_registry = True
+        while True:
+            with ExitStack() as stack:
+                sources, hashes, reused = await self._prepare_sources(
+                    stack, items, kinds, upload_urls, use_registry
+                )
+                try:
+                    result = await send(chat_id, sources, kinds, caption)
+                except BadRequest as e:
+                    if reused:
+                        print(f"Telegram rejected cached file_id, uploading files instead: {e}")
+                        uploaded_assets.forget('telegram', self.bot_id, reused)
+                        use_registry = False
+                        continue
+                    if not upload_urls and any(is_url(item) for item in items):
+                        print(f"Telegram could not fetch media by URL, uploading files instead: {e}")
+                        upload_urls = True
+                        continue
+                    raise
+
+            self._remember_uploads(result if isinstance(result, list) else [result], hashes)
+            return result
+
+    async def _send_single(self, chat_id: str, sources: List, kinds: List[str], caption: Optional[str]):
+        if kinds[0] == 'photo':
+            return await self.bot.send_photo(chat_id=chat_id, photo=sources[0], caption=caption)
+        if kinds[0] == 'video':
+            return await self.bot.send_video(chat_id=chat_id, video=sources[0], caption=caption)
+        return await self.bot.send_document(chat_id=chat_id, document=sources[0], caption=caption)
+
+    async def _send_album(self, chat_id: str, sources: List, kinds: List[str], caption: Optional[str]):
+        input_media = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
+        album = [
+            input_media[kind](media=source, caption=caption if index == 0 else None)
+            for index, (source, kind) in enumerate(zip(sources, kinds))
+        ]
+        return list(await self.bot.send_media_group(chat_id=chat_id, media=album))
+
+    async def _prepare_sources(self, stack: ExitStack, items: List[str], kinds: List[str],
+                               upload_urls: bool, use_registry: bool):
+        """
+        Подготовить то, что передаётся в Bot API: URL и file_id — как есть, локальные
+        файлы — открытыми. URL скачиваются (параллельно, через общий кэш медиа), если
+        upload_urls, тип по URL неизвестен или это видео для перекодирования; не скачавшийся
+        URL передаётся как есть. Видео заменяются вариантом под требования Telegram.
+        Файл, который этот бот уже загружал (в том числе URL, который уже лежит в кэше),
+        заменяется его file_id.
+
+        Возвращает (источники, хэши содержимого файлов или None, хэши взятых из реестра).
+        """
+        from app.utils.media_cache import cached_media, fetch_media, media_content_hash
+
+        # Видео скачиваем всегда, когда включено перекодирование: Telegram не проверяет
+        # кодек видео по URL, и неподходящее видео в клиентах не воспроизводится
+        to_fetch = [
+            item for item, kind in zip(items, kinds)
+            if is_url(item) and (upload_urls or kind == 'document'
+                                 or (kind == 'video' and settings.media_transcode_enabled))
+        ]
+        paths = await asyncio.gather(*[asyncio.to_thread(fetch_media, url) for url in to_fetch])
+        downloaded = dict(zip(to_fetch, paths))
+
+        local_paths = []
+        for item in items:
+            if is_url(item):
+                local_paths.append(downloaded.get(item) or cached_media(item))
+            else:
+                local_paths.append(item if os.path.isfile(item) else None)
+
+        # Видео — в вариант под требования Telegram (H.264/AAC, размер в пределах лимита бота)
+        local_paths = await asyncio.gather(*[
+            prepare_video_async(path, 'telegram') if path and kind == 'video' else asyncio.sleep(0, path)
+            for path, kind in zip(local_paths, kinds)
+        ])
+
+        hashes = [media_content_hash(path) if path else None for path in local_paths]
+        known = uploaded_assets.get_many('telegram', self.bot_id, [h for h in hashes if h]) if use_registry else {}
+
+        sources = []
+        reused = []
+        for item, path, content_hash in zip(items, local_paths, hashes):
+            if content_hash in known:
+                sources.append(known[content_hash])
+                reused.append(content_hash)
+            elif path and (not is_url(item) or item in downloaded):
+                # Файлы из кэша медиа не удаляем — их используют другие получатели
+                sources.append(stack.enter_context(open(path, 'rb')))
+            else:
+                sources.append(item)
+        return sources, hashes, reused
+
+    def _remember_uploads(self, messages: List, hashes: List[Optional[str]]):
+        """Сохранить file_id отправленных файлов в реестр загруженных файлов"""
+        handles = {}
+        for message, content_hash in zip(messages, hashes):
+            if not content_hash:
+                continue
+            if message.photo:
+                handles[content_hash] = message.photo[-1].file_id
+            else:
+                media = message.video or message.document or message.animation
+                if media:
+                    handles[content_hash] = media.file_id
+        uploaded_assets.remember('telegram', self.bot_id, handles)
+
+    async def set_webhook(self, url: str, secret_token: str) -> Dict:
+        """Направить обновления канала на вебхук (getUpdates после этого недоступен)"""
+        try:
+            await self.bot.set_webhook(url=url, secret_token=secret_token, allowed_updates=['channel_post'])
+            return {"success": True, "url": url}
         except TelegramError as e:
-            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации в Telegram"
-            print(f"Error posting to Telegram: {error_message}")
+            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при установке вебхука Telegram"
+            print(f"Error setting Telegram webhook: {error_message}")
             return {"error": error_message}
 
     async def validate_token(self) -> Dict:
@@ -156,3 +398,15 @@ class TelegramClient:
                 "error": "Ошибка проверки токена",
                 "message": str(e)
             }
+
+
+_telegram_pool = ClientPool(
+    TelegramClient,
+    max_size=settings.client_pool_max_size,
+    idle_ttl=settings.client_pool_idle_seconds
+)
+
+
+def get_telegram_client(bot_token: str) -> TelegramClient:
+    """Получить клиент Telegram из пула процесса"""
+    return _telegram_pool.get(credentials_key(bot_token), bot_token)
@@ -1,11 +1,48 @@
+import threading
+import time
 import vk_api
+from concurrent.futures import ThreadPoolExecutor
+from vk_api.requests_pool import VkRequestsPool
 from typing import Dict, List, Optional
 from datetime import datetime
+from app.core.config import settings
+from app.services.rate_limiter import rate_limiter
+from app.services.uploaded_assets import uploaded_assets
+from app.social.client_pool import ClientPool, credentials_key
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """
+    VkApi, все вызовы которого проходят через общий для воркеров лимит на токен
+    (rate_limit_vk_per_second). Встроенная задержка vk_api между запросами действует
+    только внутри одной сессии, поэтому она отключена — её заменяет лимит в Redis.
+    """
+
+    RPS_DELAY = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limit_key = f"vk:{credentials_key(self.token.get('access_token') or '')[:16]}"
+
+    def method(self, method, values=None, **kwargs):
+        # kwargs — captcha_sid, captcha_key и raw: с ними vk_api повторяет запрос после капчи
+        rate_limiter.acquire(self.rate_limit_key, settings.rate_limit_vk_per_second)
+        return super().method(method, values, **kwargs)
+
+    def too_many_rps_handler(self, error):
+        """Ошибка 6: VK считает, что лимит превышен, — притормаживаем все воркеры с этим токеном"""
+        rate_limiter.block(self.rate_limit_key, 1)
+        return error.try_method()
+
+
+# Адреса загрузки фото на стену: (credentials_key(токен), group_id) -> (upload_url, время получения).
+# Адрес не привязан к файлу, поэтому его можно использовать для многих загрузок подряд
+_upload_servers: Dict[tuple, tuple] = {}
+_upload_servers_lock = threading.Lock()
 
 class VKClient:
     def __init__(self, access_token: str):
         self.access_token = access_token
-        self.vk_session = vk_api.VkApi(token=access_token)
+        self.vk_session = RateLimitedVkApi(token=access_token)
         self.vk = self.vk_session.get_api()
 
     def get_latest_posts(self, owner_id: str, count: int = 10) -> List[Dict]:
@@ -18,6 +55,145 @@ class VKClient:
             print(f"Error getting VK posts: {error_message}")
             return [{"error": error_message}]
 
+    def get_posts_since(self, owner_id: str, since_id: Optional[int] = None,
+                        page_size: int = 10, max_pages: int = 10) -> List[Dict]:
+        """
+        Получить посты новее since_id (от новых к старым).
+
+        Первая страница маленькая — при обычном опросе её достаточно, чтобы дойти до
+        уже виденных постов. Если новых постов больше (например, после простоя),
+        дочитываем стену страницами по 100 постов, пока не встретим since_id или
+        не исчерпаем max_pages. Закреплённый пост стоит первым независимо от даты,
+        поэтому он не считается признаком «дошли до старых» и попадает в результат
+        только если сам новее курсора. Без курсора читается одна страница.
+        """
+        try:
+            posts = []
+            offset = 0
+            count = page_size
+
+            for _ in range(max_pages):
+                response = self.vk.wall.get(owner_id=owner_id, count=count, offset=offset)
+                items = response.get('items', [])
+
+                new_posts, reached_seen = self.filter_new_posts(items, since_id)
+                posts.extend(new_posts)
+
+                if reached_seen or since_id is None or len(items) < count:
+                    break
+
+                offset += count
+                count = 100  # Максимум для wall.get
+
+            return posts
+        except Exception as e:
+            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при получении постов из VK"
+            print(f"Error getting VK posts: {error_message}")
+            return [{"error": error_message}]
+
+    def get_posts_batch(self, owner_ids: List[str], count: int = 10) -> Dict[str, List[Dict]]:
+        """
+        Получить последние посты сразу нескольких стен.
+
+        Вызовы wall.get упаковываются по 25 штук в один запрос execute (VkRequestsPool),
+        поэтому опрос 25 сообществ стоит одного HTTP-запроса вместо 25.
+        Возвращает словарь owner_id -> список постов; при ошибке для конкретной стены
+        список содержит один элемент {"error": ...}, как в get_latest_posts.
+        """
+        results = {}
+        try:
+            with VkRequestsPool(self.vk_session) as pool:
+                requests = {
+                    str(owner_id): pool.method('wall.get', {'owner_id': owner_id, 'count': count})
+                    for owner_id in owner_ids
+                }
+        except Exception as e:
+            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при получении постов из VK"
+            print(f"Error getting VK posts batch: {error_message}")
+            return {str(owner_id): [{"error": error_message}] for owner_id in owner_ids}
+
+        for owner_id, request in requests.items():
+            if request.ok:
+                results[owner_id] = request.result.get('items', [])
+            else:
+                error = request.error or {}
+                error_message = error.get('error_msg', str(error)) if isinstance(error, dict) else str(error)
+                print(f"Error getting VK posts for {owner_id}: {error_message}")
+                results[owner_id] = [{"error": error_message}]
+
+        return results
+
+    @staticmethod
+    def process_post(post: Dict) -> Dict:
+        """Извлечь из поста VK текст и ссылки на медиа (фото максимального размера, плеер видео)"""
+        processed_post = {
+            'id': post.get('id'),
+            'text': post.get('text', ''),
+            'date': post.get('date'),
+            'media': []
+        }
+
+        # Обрабатываем вложения
+        for attachment in post.get('attachments', []):
+            if attachment['type'] == 'photo':
+                # Берем фото самого большого размера
+                sizes = attachment['photo']['sizes']
+                max_size_photo = max(sizes, key=lambda x: x['width'])
+                processed_post['media'].append(max_size_photo['url'])
+            elif attachment['type'] == 'video':
+                # Для видео добавляем ссылку на видео (если доступна)
+                if 'player' in attachment['video']:
+                    processed_post['media'].append(attachment['video']['player'])
+
+        return processed_post
+
+    def get_callback_confirmation_code(self, group_id: int) -> str:
+        """Строка, которой сервер должен ответить на событие confirmation Callback API"""
+        return self.vk.groups.getCallbackConfirmationCode(group_id=group_id)['code']
+
+    def register_callback_server(self, group_id: int, url: str, secret_key: str) -> Dict:
+        """
+        Подключить Callback API сообщества: добавить сервер и подписать его на wall_post_new.
+        Нужен токен сообщества с правом управления. VK сразу проверяет адрес событием
+        confirmation, поэтому строку подтверждения нужно сохранить заранее.
+        """
+        try:
+            server = self.vk.groups.addCallbackServer(
+                group_id=group_id,
+                url=url,
+                title='CrossPoster',
+                secret_key=secret_key
+            )
+            self.vk.groups.setCallbackSettings(
+                group_id=group_id,
+                server_id=server['server_id'],
+                api_version=self.vk_session.api_version,
+                wall_post_new=1
+            )
+            return {'server_id': server['server_id']}
+        except Exception as e:
+            error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при подключении Callback API"
+            print(f"Error registering VK callback server: {error_message}")
+            return {"error": error_message}
+
+    @staticmethod
+    def filter_new_posts(items: List[Dict], since_id: Optional[int]):
+        """
+        Отобрать из страницы wall.get посты новее since_id.
+        Возвращает (новые посты, встретился ли уже виденный пост).
+        """
+        posts = []
+        for item in items:
+            is_new = since_id is None or item['id'] > since_id
+            if item.get('is_pinned'):
+                if is_new and since_id is not None:
+                    posts.append(item)
+                continue
+            if not is_new:
+                return posts, True
+            posts.append(item)
+        return posts, False
+
     def validate_token(self) -> Dict:
         """Проверить валидность токена VK"""
         try:
@@ -101,26 +277,28 @@ class VKClient:
             all_attachments = list(attachments) if attachments else []
 
             if media_urls:
-                import uuid
-                from app.utils.media_downloader import download_media, get_file_extension
+                from app.utils.media_cache import fetch_media, prefetch_media
 
                 # Убираем минус из ID группы для загрузки фото
                 group_id = owner_id.lstrip('-') if owner_id.startswith('-') else None
 
-                for media_url in media_urls:
-                    file_extension = get_file_extension(media_url)
-                    temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-
-                    downloaded_path = download_media(media_url, temp_filename)
-                    if downloaded_path:
-                        attachment = self.upload_photo(downloaded_path, group_id)
-                        if attachment:
-                            all_attachments.append(attachment)
+                # Скачиваем все медиафайлы параллельно, дальше они берутся из кэша
+                prefetch_media(media_urls)
+                photo_paths = [path for path in (fetch_media(url) for url in media_urls) if path]
+                all_attachments.extend(self.upload_photos(photo_paths, group_id))
 
             if all_attachments:
                 post_data['attachments'] = ','.join(all_attachments)
 
-            result = self.vk.wall.post(**post_data)
+            try:
+                result = self.vk.wall.post(**post_data)
+            except vk_api.exceptions.ApiError as e:
+                if e.code == 100 and all_attachments:
+                    # Вложение могли удалить — не переиспользуем его attachment-строку
+                    # (фото могли загружаться и в сообщество, и на стену пользователя)
+                    for group_id in {owner_id.lstrip('-'), None}:
+                        uploaded_assets.forget_handles('vk', self._asset_scope(group_id), all_attachments)
+                raise
             return result
         except Exception as e:
             error_message = str(e) if str(e) != "None" else "Неизвестная ошибка при публикации в VK"
@@ -129,15 +307,131 @@ class VKClient:
 
     def upload_photo(self, photo_path: str, group_id: Optional[str] = None) -> str:
         """Загрузить фото в VK и вернуть attachment строку"""
+        attachments = self.upload_photos([photo_path], group_id)
+        return attachments[0] if attachments else ""
+
+    def _get_wall_upload_url(self, group_id: Optional[str], refresh: bool = False) -> str:
+        """Адрес сервера загрузки фото на стену (кэшируется на vk_upload_server_ttl_seconds)"""
+        key = (credentials_key(self.access_token), group_id)
+        with _upload_servers_lock:
+            cached = _upload_servers.get(key)
+            if cached and not refresh and time.monotonic() - cached[1] < settings.vk_upload_server_ttl_seconds:
+                return cached[0]
+
+        values = {'group_id': group_id} if group_id else {}
+        upload_url = self.vk.photos.getWallUploadServer(**values)['upload_url']
+        with _upload_servers_lock:
+            _upload_servers[key] = (upload_url, time.monotonic())
+        return upload_url
+
+    def _send_photo(self, upload_url: str, photo_path: str) -> Dict:
+        """Отправить файл на сервер загрузки; вернуть ответ (photo, server, hash)"""
+        with open(photo_path, 'rb') as f:
+            response = self.vk_session.http.post(upload_url, files={'photo': f}).json()
+        if not response.get('photo') or response.get('photo') == '[]':
+            raise vk_api.exceptions.VkApiError(response.get('error') or 'Сервер загрузки не принял фото')
+        return response
+
+    def upload_photos(self, photo_paths: List[str], group_id: Optional[str] = None) -> List[str]:
+        """
+        Загрузить несколько фото на стену и вернуть attachment-строки в исходном порядке.
+
+        Адрес сервера загрузки берётся из кэша, файлы отправляются на него параллельно
+        (до vk_upload_concurrency одновременно), а все photos.saveWallPhoto выполняются
+        одним запросом execute. Пост из 10 фото стоит одного getWallUploadServer (или ни
+        одного), параллельных загрузок и одного execute. Не загрузившиеся фото пропускаются.
+        Фото, уже загруженные этим токеном в это сообщество, берутся из реестра
+        загруженных файлов и не загружаются повторно.
+        """
+        if not photo_paths:
+            return []
+
+        from app.utils.media_cache import media_content_hash
+
+        # Для загрузки нужен ID сообщества без минуса
+        group_id = str(group_id).lstrip('-') if group_id else None
+
+        # Фото, которые уже загружались в это сообщество, берём из реестра без загрузки
+        scope = self._asset_scope(group_id)
+        hashes = [media_content_hash(path) for path in photo_paths]
+        known = uploaded_assets.get_many('vk', scope, hashes)
+        pending = [(path, h) for path, h in zip(photo_paths, hashes) if h not in known]
+        if not pending:
+            return [known[h] for h in hashes]
+
+        uploaded = self._upload_new_photos([path for path, _ in pending], group_id)
+        fresh = {h: attachment for (_, h), attachment in zip(pending, uploaded) if attachment}
+        uploaded_assets.remember('vk', scope, fresh)
+
+        return [known.get(h) or fresh[h] for h in hashes if h in known or h in fresh]
+
+    def _asset_scope(self, group_id: Optional[str]) -> str:
+        """Область реестра загруженных фото: токен (по хэшу) и сообщество"""
+        return f"{credentials_key(self.access_token)[:16]}:{group_id or 'user'}"
+
+    def _upload_new_photos(self, photo_paths: List[str], group_id: Optional[str]) -> List[Optional[str]]:
+        """Загрузить фото на сервер и сохранить; для каждого файла attachment-строка или None"""
         try:
-            upload = vk_api.VkUpload(self.vk_session)
-            if group_id:
-                photo = upload.photo_wall(photo_path, group_id=group_id)
-            else:
-                photo = upload.photo_wall(photo_path)
-            owner_id = photo[0]['owner_id']
-            photo_id = photo[0]['id']
-            return f'photo{owner_id}_{photo_id}'
+            upload_url = self._get_wall_upload_url(group_id)
+        except Exception as e:
+            print(f"Error uploading photo to VK: {e}")
+            return [None] * len(photo_paths)
+
+        def send(photo_path: str) -> Optional[Dict]:
+            nonlocal upload_url
+            for attempt in range(2):
+                try:
+                    return self._send_photo(upload_url, photo_path)
+                except Exception as e:
+                    if attempt:
+                        print(f"Error uploading photo to VK: {e}")
+                        return None
+                    # Адрес мог устареть — получаем новый и пробуем ещё раз
+                    try:
+                        upload_url = self._get_wall_upload_url(group_id, refresh=True)
+                    except Exception as e:
+                        print(f"Error uploading photo to VK: {e}")
+                        return None
+
+        workers = min(len(photo_paths), settings.vk_upload_concurrency)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            uploads = list(executor.map(send, photo_paths))
+
+        try:
+            with VkRequestsPool(self.vk_session) as pool:
+                saves = [
+                    pool.method('photos.saveWallPhoto', {
+                        **({'group_id': group_id} if group_id else {}),
+                        'photo': uploaded['photo'],
+                        'server': uploaded['server'],
+                        'hash': uploaded['hash'],
+                    }) if uploaded else None
+                    for uploaded in uploads
+                ]
         except Exception as e:
             print(f"Error uploading photo to VK: {e}")
-            return ""
+            return [None] * len(photo_paths)
+
+        attachments = []
+        for save in saves:
+            if save is None:
+                attachments.append(None)
+            elif not save.ok:
+                print(f"Error uploading photo to VK: {save.error}")
+                attachments.append(None)
+            else:
+                photo = save.result[0]
+                attachments.append(f"photo{photo['owner_id']}_{photo['id']}")
+        return attachments
+
+
+_vk_pool = ClientPool(
+    VKClient,
+    max_size=settings.client_pool_max_size,
+    idle_ttl=settings.client_pool_idle_seconds
+)
+
+
+def get_vk_client(access_token: str) -> VKClient:
+    """Получить клиент VK из пула процесса (сессия requests переиспользуется)"""
+    return _vk_pool.get(credentials_key(access_token), access_token)
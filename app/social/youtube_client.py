@@ -1,46 +1,158 @@
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from typing import Dict, List, Optional
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaFileUpload, build_http
+from typing import Callable, Dict, List, Optional
+import json
 import os
+import threading
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.social.client_pool import ClientPool, credentials_key
+
+# channel_id -> ID плейлиста загрузок (не меняется у канала, храним без срока)
+_UPLOADS_PLAYLISTS_KEY = "crossposter:yt:uploads"
+
+_thread_local = threading.local()
+
+
+def _build_request(http, *args, **kwargs):
+    """
+    Построить запрос API на HTTP-клиенте текущего потока.
+    httplib2.Http не потокобезопасен, а клиент из пула используют разные потоки,
+    поэтому у каждого потока свой Http (со своими keep-alive соединениями).
+    """
+    thread_http = getattr(_thread_local, 'http', None)
+    if thread_http is None:
+        thread_http = _thread_local.http = build_http()
+    return HttpRequest(thread_http, *args, **kwargs)
+
+def _resume_upload(request: HttpRequest, resumable_uri: str):
+    """
+    Направить resumable-запрос в уже открытую сессию загрузки.
+
+    Публичного API для этого у googleapiclient нет. Пока _in_error_state выставлен,
+    HttpRequest.next_chunk вместо данных отправляет пустой PUT с «Content-Range: bytes */size»
+    и по ответу (308 и заголовок Range) узнаёт, сколько байт сервер уже получил, — с этого
+    места и продолжается загрузка. Поведение проверено на google-api-python-client 2.111.0
+    (версия закреплена в requirements.txt); при обновлении библиотеки его нужно перепроверить.
+    """
+    if not hasattr(request, '_in_error_state'):
+        raise RuntimeError("googleapiclient HttpRequest больше не поддерживает продолжение загрузки")
+    request.resumable_uri = resumable_uri
+    request._in_error_state = True
+
 
 class YouTubeClient:
     def __init__(self, api_key: str, client_secrets_file: Optional[str] = None):
         self.api_key = api_key
         self.client_secrets_file = client_secrets_file
-        self.youtube = build('youtube', 'v3', developerKey=api_key)
+        self.youtube = build('youtube', 'v3', developerKey=api_key, requestBuilder=_build_request)
     
+    def get_uploads_playlist_id(self, channel_id: str) -> Optional[str]:
+        """Получить ID плейлиста загрузок канала (с кэшированием в Redis)"""
+        redis = get_redis()
+        playlist_id = redis.hget(_UPLOADS_PLAYLISTS_KEY, channel_id)
+        if playlist_id:
+            return playlist_id
+
+        response = self.youtube.channels().list(part='contentDetails', id=channel_id).execute()
+        items = response.get('items', [])
+        if not items:
+            return None
+
+        playlist_id = items[0]['contentDetails']['relatedPlaylists']['uploads']
+        redis.hset(_UPLOADS_PLAYLISTS_KEY, channel_id, playlist_id)
+        return playlist_id
+
     def get_latest_videos(self, channel_id: str, count: int = 10) -> List[Dict]:
-        """Получить последние видео с канала"""
+        """
+        Получить последние видео с канала.
+
+        Читаем плейлист загрузок канала (playlistItems.list — 1 единица квоты) вместо
+        search.list (100 единиц). Ответ кэшируется вместе с ETag, и повторный запрос
+        идёт с If-None-Match: если на канале ничего не изменилось, API отвечает 304
+        и мы возвращаем видео из кэша.
+        """
         try:
-            request = self.youtube.search().list(
-                part='snippet',
-                channelId=channel_id,
-                order='date',
-                type='video',
+            playlist_id = self.get_uploads_playlist_id(channel_id)
+            if not playlist_id:
+                print(f"YouTube channel not found: {channel_id}")
+                return []
+
+            redis = get_redis()
+            cache_key = f"crossposter:yt:playlist:{playlist_id}:{count}"
+            cached = redis.get(cache_key)
+            cached = json.loads(cached) if cached else None
+
+            request = self.youtube.playlistItems().list(
+                part='snippet,contentDetails',
+                playlistId=playlist_id,
                 maxResults=count
             )
-            response = request.execute()
-            
+            if cached:
+                request.headers['If-None-Match'] = cached['etag']
+
+            try:
+                response = request.execute()
+            except HttpError as e:
+                if e.resp.status == 304 and cached:
+                    return cached['videos']
+                raise
+
             videos = []
             for item in response.get('items', []):
+                snippet = item['snippet']
                 video = {
-                    'id': item['id']['videoId'],
-                    'title': item['snippet']['title'],
-                    'description': item['snippet']['description'],
-                    'published_at': item['snippet']['publishedAt'],
-                    'thumbnail_url': item['snippet']['thumbnails']['default']['url']
+                    'id': snippet['resourceId']['videoId'],
+                    'title': snippet['title'],
+                    'description': snippet['description'],
+                    'published_at': item.get('contentDetails', {}).get('videoPublishedAt', snippet['publishedAt']),
+                    'thumbnail_url': snippet.get('thumbnails', {}).get('default', {}).get('url')
                 }
                 videos.append(video)
-            
+
+            if response.get('etag'):
+                redis.set(cache_key, json.dumps({'etag': response['etag'], 'videos': videos}))
+
             return videos
         except Exception as e:
             print(f"Error getting YouTube videos: {e}")
             return []
     
-    def upload_short(self, video_path: str, title: str, description: str, 
-                     tags: Optional[List[str]] = None) -> Dict:
-        """Загрузить короткое видео на YouTube"""
+    def _upload_state_key(self, upload_key: str) -> str:
+        return f"crossposter:yt:upload:{credentials_key(self.api_key)[:16]}:{upload_key}"
+
+    def get_upload_progress(self, upload_key: str) -> Optional[Dict]:
+        """Состояние незавершённой загрузки: {'resumable_uri', 'offset', 'total', 'content_hash'} или None"""
+        state = get_redis().get(self._upload_state_key(upload_key))
+        return json.loads(state) if state else None
+
+    def upload_short(self, video_path: str, title: str, description: str,
+                     tags: Optional[List[str]] = None, upload_key: Optional[str] = None,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> Dict:
+        """
+        Загрузить короткое видео на YouTube.
+
+        Видео, не подходящее под требования Shorts, предварительно перекодируется.
+        Видео отправляется частями по youtube_upload_chunk_bytes через resumable-сессию.
+        После каждой части адрес сессии и подтверждённое смещение сохраняются в Redis
+        по upload_key (по умолчанию — хэш содержимого файла и заголовок), поэтому после
+        падения или перезапуска воркера любой воркер продолжает загрузку с того же места,
+        а не отправляет файл заново. Продолжается только загрузка того же содержимого
+        (сверяются хэш и размер файла), иначе загрузка начинается заново. on_progress(отправлено_байт, всего_байт) вызывается
+        после каждой части.
+        """
         try:
+            from app.utils.media_cache import media_content_hash
+            from app.utils.media_transcoder import VideoRejected, prepare_video
+
+            try:
+                video_path = prepare_video(video_path, 'youtube')
+            except VideoRejected as e:
+                # Повтор не поможет — видео не подходит для Shorts
+                print(f"Video rejected for YouTube: {e}")
+                return {"error": str(e), "retryable": False}
+
             # Создание объекта видео
             body = {
                 'snippet': {
@@ -54,17 +166,62 @@ class YouTubeClient:
                     'selfDeclaredMadeForKids': False
                 }
             }
-            
-            # Загрузка видео
-            media = MediaFileUpload(video_path, chunksize=-1, resumable=True, mimetype='video/*')
-            
+
+            content_hash = media_content_hash(video_path)
+            if upload_key is None:
+                upload_key = f"{content_hash}:{credentials_key(title)[:16]}"
+            state_key = self._upload_state_key(upload_key)
+            redis = get_redis()
+
+            # Загрузка видео частями
+            media = MediaFileUpload(
+                video_path, chunksize=settings.youtube_upload_chunk_bytes, resumable=True, mimetype='video/*'
+            )
             request = self.youtube.videos().insert(
                 part='snippet,status',
                 body=body,
                 media_body=media
             )
-            
-            response = request.execute()
+
+            saved = self.get_upload_progress(upload_key)
+            if saved and (saved.get('content_hash') != content_hash or saved.get('total') != media.size()):
+                # На этом хосте файл другой (скачан или перекодирован заново иначе) —
+                # продолжение склеило бы в YouTube части разных файлов
+                print(f"YouTube upload {upload_key} was started with different file contents, starting over")
+                redis.delete(state_key)
+                saved = None
+            if saved:
+                print(f"Resuming YouTube upload {upload_key} from byte {saved['offset']}")
+                # Сначала спрашиваем у YouTube, сколько байт он уже получил, —
+                # сохранённое смещение могло отстать от сервера
+                _resume_upload(request, saved['resumable_uri'])
+
+            response = None
+            while response is None:
+                try:
+                    status, response = request.next_chunk(num_retries=settings.youtube_upload_retries)
+                except HttpError as e:
+                    if saved and e.resp.status in (404, 410):
+                        # Сессия загрузки истекла — начинаем заново
+                        print(f"YouTube upload session {upload_key} expired, starting over")
+                        redis.delete(state_key)
+                        return self.upload_short(video_path, title, description, tags, upload_key, on_progress)
+                    raise
+
+                if status:
+                    redis.set(state_key, json.dumps({
+                        'resumable_uri': request.resumable_uri,
+                        'offset': status.resumable_progress,
+                        'total': status.total_size,
+                        'content_hash': content_hash,
+                    }), ex=settings.youtube_upload_session_ttl_seconds)
+                    if on_progress:
+                        on_progress(status.resumable_progress, status.total_size)
+
+            redis.delete(state_key)
+            if on_progress:
+                on_progress(media.size(), media.size())
+
             return {
                 'video_id': response['id'],
                 'url': f"https://www.youtube.com/shorts/{response['id']}"
@@ -114,4 +271,16 @@ class YouTubeClient:
                     "valid": False,
                     "error": "Ошибка проверки API ключа",
                     "message": error_message
-                }
\ No newline at end of file
+                }
+
+
+_youtube_pool = ClientPool(
+    YouTubeClient,
+    max_size=settings.client_pool_max_size,
+    idle_ttl=settings.client_pool_idle_seconds
+)
+
+
+def get_youtube_client(api_key: str) -> YouTubeClient:
+    """Получить клиент YouTube из пула процесса (discovery-документ загружается один раз)"""
+    return _youtube_pool.get(credentials_key(api_key), api_key)
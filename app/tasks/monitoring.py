@@ -1,63 +1,132 @@
-import asyncio
 import uuid
-from celery import Celery
+from typing import Optional
+from celery import Celery, chord, group
+from celery.signals import worker_process_shutdown
 from app.core.config import settings
-from app.social.vk_client import VKClient
-from app.social.telegram_client import TelegramClient
-from app.social.instagram_client import InstagramClient
-from app.social.pinterest_client import PinterestClient
-from app.social.youtube_client import YouTubeClient
-from app.utils.media_downloader import download_media, get_file_extension
+from app.social.vk_client import VKClient, get_vk_client
+from app.social.telegram_client import get_telegram_client
+from app.social.instagram_client import get_instagram_client
+from app.social.pinterest_client import get_pinterest_client
+from app.social.youtube_client import get_youtube_client
+from app.utils.media_cache import fetch_media, prefetch_media
+from app.utils.async_loop import background_loop, run_async
+from app.services.seen_posts import seen_post_index
+from app.services.poll_schedule import record_poll_result
+from app.services.publish_jobs import dead_letters, publish_key, publish_ledger, retry_countdown, source_key
+from app.tasks.routing import celery_config
+from app.services.deliveries import mark_delivery_finished, mark_delivery_retrying, mark_delivery_started
 
 # Инициализация Celery
-celery_app = Celery("crossposter", broker=settings.redis_url)
+celery_app = Celery("crossposter", broker=settings.redis_url, backend=settings.redis_url)
+# Очереди и маршрутизация задач по классу нагрузки — см. app/tasks/routing.py
+celery_app.conf.update(**celery_config())
 
 
-def run_async(coro):
-    """Безопасное выполнение async функции в синхронном контексте"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+@worker_process_shutdown.connect
+def _stop_background_loop(**kwargs):
+    """Остановить фоновый event loop воркера при завершении процесса"""
+    background_loop.stop()
+
+
+def _handle_vk_posts(account_id: int, posts: list, since_id: int = None) -> list:
+    """Отобрать новые посты VK, обновить курсор и интервал опроса, извлечь медиа"""
+    # Курсор сдвигается на самый свежий прочитанный пост
+    cursor = max([since_id or 0] + [post['id'] for post in posts]) or None
+    
+    # Отбрасываем посты, которые уже были обработаны
+    new_ids = set(seen_post_index.claim_new('vk', account_id, [post.get('id') for post in posts]))
+    posts = [post for post in posts if str(post.get('id')) in new_ids]
+    
+    # Подстраиваем интервал опроса под активность источника
+    record_poll_result(account_id, len(posts), cursor=cursor)
+    
+    # TODO: Отправить новые посты в очередь для репоста
+    
+    # Обрабатываем посты для извлечения медиа
+    processed_posts = [VKClient.process_post(post) for post in posts]
+    
+    return processed_posts
+
+@celery_app.task
+def check_vk_posts(account_id: int, access_token: str, owner_id: str, since_id: int = None):
+    """Проверить новые посты в VK начиная с курсора since_id"""
     try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+        vk_client = get_vk_client(access_token)
+        posts = vk_client.get_posts_since(
+            owner_id,
+            since_id=since_id,
+            page_size=settings.vk_poll_page_size,
+            max_pages=settings.vk_poll_max_pages,
+        )
+        if posts and 'error' in posts[0]:
+            return {"status": "error", "message": posts[0]['error']}
         
+        return {"status": "success", "posts": _handle_vk_posts(account_id, posts, since_id)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
 @celery_app.task
-def check_vk_posts(account_id: int, access_token: str, owner_id: str):
-    """Проверить новые посты в VK"""
+def check_vk_posts_batch(access_token: str, accounts: list):
+    """
+    Проверить новые посты сразу нескольких сообществ VK с одним токеном.
+    
+    accounts — список [account_id, owner_id, since_id]. Первые страницы всех стен
+    читаются одним запросом execute; стены, где новых постов больше страницы
+    (например, после простоя), дочитываются отдельно через get_posts_since.
+    """
     try:
-        vk_client = VKClient(access_token)
-        posts = vk_client.get_latest_posts(owner_id, count=5)
-        
-        # TODO: Проверить, какие посты уже были обработаны
-        # TODO: Отправить новые посты в очередь для репоста
-        
-        # Обрабатываем посты для извлечения медиа
-        processed_posts = []
-        for post in posts:
-            processed_post = {
-                'id': post.get('id'),
-                'text': post.get('text', ''),
-                'date': post.get('date'),
-                'media': []
-            }
+        vk_client = get_vk_client(access_token)
+        pages = vk_client.get_posts_batch(
+            [owner_id for _, owner_id, _ in accounts],
+            count=settings.vk_poll_page_size,
+        )
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    
+    results = {}
+    for account_id, owner_id, since_id in accounts:
+        try:
+            page = pages.get(str(owner_id), [])
+            if page and 'error' in page[0]:
+                results[account_id] = {"status": "error", "message": page[0]['error']}
+                continue
             
-            # Обрабатываем вложения
-            if 'attachments' in post:
-                for attachment in post['attachments']:
-                    if attachment['type'] == 'photo':
-                        # Берем фото самого большого размера
-                        sizes = attachment['photo']['sizes']
-                        max_size_photo = max(sizes, key=lambda x: x['width'])
-                        processed_post['media'].append(max_size_photo['url'])
-                    elif attachment['type'] == 'video':
-                        # Для видео добавляем ссылку на видео (если доступна)
-                        if 'player' in attachment['video']:
-                            processed_post['media'].append(attachment['video']['player'])
+            posts, reached_seen = VKClient.filter_new_posts(page, since_id)
+            if since_id is not None and not reached_seen and len(page) >= settings.vk_poll_page_size:
+                posts = vk_client.get_posts_since(
+                    owner_id,
+                    since_id=since_id,
+                    page_size=settings.vk_poll_page_size,
+                    max_pages=settings.vk_poll_max_pages,
+                )
+                if posts and 'error' in posts[0]:
+                    results[account_id] = {"status": "error", "message": posts[0]['error']}
+                    continue
             
-            processed_posts.append(processed_post)
-        
-        return {"status": "success", "posts": processed_posts}
+            results[account_id] = {"status": "success", "posts": _handle_vk_posts(account_id, posts, since_id)}
+        except Exception as e:
+            results[account_id] = {"status": "error", "message": str(e)}
+    
+    return {"status": "complete", "results": results}
+
+def _handle_telegram_posts(account_id: int, posts: list) -> list:
+    """Отобрать новые посты Telegram и обновить интервал опроса"""
+    # Отбрасываем посты, которые уже были обработаны
+    new_ids = set(seen_post_index.claim_new('telegram', account_id, [post['id'] for post in posts]))
+    posts = [post for post in posts if str(post['id']) in new_ids]
+    
+    # Подстраиваем интервал опроса под активность источника
+    record_poll_result(account_id, len(posts))
+    
+    # TODO: Отправить новые посты в очередь для репоста
+    
+    return posts
+
+@celery_app.task
+def ingest_vk_posts(account_id: int, posts: list):
+    """Обработать посты, полученные через VK Callback API"""
+    try:
+        return {"status": "success", "posts": _handle_vk_posts(account_id, posts)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -65,12 +134,28 @@ def check_vk_posts(account_id: int, access_token: str, owner_id: str):
 def check_telegram_posts(account_id: int, bot_token: str, chat_id: str):
     """Проверить новые посты в Telegram"""
     try:
-        telegram_client = TelegramClient(bot_token)
-        posts = run_async(telegram_client.get_latest_posts(chat_id, limit=5))
+        from app.services.telegram_updates import TelegramUpdateDispatcher, uses_webhook
         
-        # TODO: Проверить, какие посты уже были обработаны
-        # TODO: Отправить новые посты в очередь для репоста
+        # Обновления бота получает один потребитель и раскладывает по чатам;
+        # если бот сейчас опрашивается другим процессом, просто забираем свою очередь.
+        # Если бот переведён на вебхук, посты в очередь кладёт сам вебхук, а getUpdates недоступен
+        dispatcher = TelegramUpdateDispatcher(bot_token)
+        dispatcher.register_chat(chat_id, account_id)
+        if not uses_webhook(dispatcher.bot_id):
+            run_async(dispatcher.poll_once())
+        posts = _handle_telegram_posts(account_id, dispatcher.drain(chat_id))
+        
+        return {"status": "success", "posts_count": len(posts)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@celery_app.task
+def ingest_telegram_chat(account_id: int, bot_id: str, chat_id: str):
+    """Обработать посты, которые вебхук положил в очередь чата"""
+    try:
+        from app.services.telegram_updates import drain_chat_posts
         
+        posts = _handle_telegram_posts(account_id, drain_chat_posts(bot_id, chat_id))
         return {"status": "success", "posts_count": len(posts)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -79,270 +164,412 @@ def check_telegram_posts(account_id: int, bot_token: str, chat_id: str):
 def check_instagram_posts(account_id: int, username: str, password: str, user_id: str):
     """Проверить новые посты в Instagram"""
     try:
-        instagram_client = InstagramClient(username, password)
+        instagram_client = get_instagram_client(username, password)
         posts = instagram_client.get_latest_posts(user_id, count=5)
         
-        # TODO: Проверить, какие посты уже были обработаны
+        # Отбрасываем посты, которые уже были обработаны
+        new_ids = set(seen_post_index.claim_new('instagram', account_id, [post['id'] for post in posts]))
+        posts = [post for post in posts if str(post['id']) in new_ids]
+        
+        # Подстраиваем интервал опроса под активность источника
+        record_poll_result(account_id, len(posts))
+        
         # TODO: Отправить новые посты в очередь для репоста
         
         return {"status": "success", "posts_count": len(posts)}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-@celery_app.task
-def repost_to_vk(post_data: dict, access_token: str, owner_id: str):
-    """Репостить контент в VK"""
+def _publish_once(task, key: str, publish) -> dict:
+    """
+    Выполнить публикацию не больше одного раза на ключ идемпотентности.
+
+    publish() возвращает {"success": bool, ...}; ошибки без "retryable": False считаются
+    временными и повторяются с экспоненциальной задержкой. Пока публикацию по ключу
+    выполняет другой воркер, задача тоже ждёт повтора. Когда повторы исчерпаны,
+    задача попадает в очередь недоставленных (dead letter queue) и возвращает ошибку.
+    """
+    # Ошибки журнала (Redis) не роняют задачу, а возвращаются как результат: иначе
+    # подзадача рассылки падает и collect_broadcast_results не вызывается
+    published = None
     try:
-        from app.utils.media_downloader import download_media, get_file_extension
-        
-        vk_client = VKClient(access_token)
+        done = publish_ledger.get(key)
+        if done is not None:
+            print(f"Publish {key} is already done, skipping")
+            return done
+
+        with publish_ledger.lease(key) as token:
+            if token is None:
+                # Этот же пост в эту же цель сейчас публикует другой воркер
+                result = {"success": False, "error": "Публикация уже выполняется другим воркером"}
+            else:
+                try:
+                    result = publish()
+                except Exception as e:
+                    error_message = str(e) if str(e) != "None" else "Неизвестная ошибка"
+                    result = {"success": False, "error": error_message}
+
+                if result.get('success'):
+                    published = result
+                    publish_ledger.complete(key, result, token)
+                    return result
+    except Exception as e:
+        if published is not None:
+            # Пост уже опубликован: повтор дал бы дубль, поэтому ошибку журнала только логируем
+            print(f"Error recording publish {key}: {e}")
+            return published
+        print(f"Publish ledger error for {key}: {e}")
+        result = {"success": False, "error": f"Ошибка журнала публикаций: {e}"}
+
+    if not result.get('retryable', True):
+        return result
+
+    if task.request.retries < task.max_retries:
+        print(f"Publish {key} failed, will retry: {result['error']}")
+        raise task.retry(countdown=retry_countdown(task.request.retries))
+
+    print(f"Publish {key} failed after {task.request.retries + 1} attempts: {result['error']}")
+    try:
+        dead_letters.push(task.name, task.request.args, task.request.kwargs, key,
+                          result['error'], task.request.retries + 1)
+    except Exception as e:
+        print(f"Error pushing {key} to dead letter queue: {e}")
+    return result
+
+@celery_app.task(bind=True, max_retries=settings.publish_max_retries)
+def repost_to_vk(self, post_data: dict, access_token: str, owner_id: str):
+    """Репостить контент в VK (post_data['source_key'] — источник поста, см. source_key)"""
+    def publish():
+        vk_client = get_vk_client(access_token)
         
         # Обрабатываем медиафайлы
         attachments = []
         if 'media' in post_data and post_data['media']:
-            for media_item in post_data['media']:
-                # Скачиваем медиафайл
-                file_extension = get_file_extension(media_item)
-                temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-                
-                downloaded_path = download_media(media_item, temp_filename)
-                if downloaded_path:
-                    # Загружаем в VK
-                    attachment = vk_client.upload_photo(downloaded_path)
-                    if attachment:
-                        attachments.append(attachment)
+            # Скачиваем все медиафайлы поста параллельно
+            prefetch_media(post_data['media'])
+            photo_paths = [path for path in (fetch_media(item) for item in post_data['media']) if path]
+            # Загружаем в VK все фото разом
+            attachments = vk_client.upload_photos(photo_paths)
         
         result = vk_client.post_to_wall(owner_id, post_data['text'], attachments)
-        return {"status": "success", "result": result}
-    except Exception as e:
+        if 'error' in result:
+            return {"success": False, "error": result['error']}
+        return {"success": True, "result": result}
+    
+    try:
+        key = publish_key(post_data, f"vk:{owner_id}")
+    except ValueError as e:
         return {"status": "error", "message": str(e)}
+    
+    result = _publish_once(self, key, publish)
+    if result.get('success'):
+        return {"status": "success", "result": result['result']}
+    return {"status": "error", "message": result['error']}
 
-@celery_app.task
-def send_test_post_to_all_platforms(post_data: dict, accounts_data: list):
+def _publish_to_account(post_data: dict, account: dict, key: Optional[str] = None, on_progress=None) -> dict:
     """
-    Отправить тестовый пост во все подключенные платформы
+    Опубликовать пост в одном целевом аккаунте.
+    key — ключ идемпотентности публикации: по нему повтор задачи продолжает многошаговую
+    публикацию (альбомы Telegram, загрузка в YouTube) с места остановки.
+    on_progress(отправлено_байт, всего_байт) получает прогресс длинных загрузок (YouTube).
     """
-    print(f"Starting send_test_post_to_all_platforms with post_data: {post_data}")
-    print(f"Accounts data: {len(accounts_data)} accounts")
+    platform = account['platform']
+    access_token = account['access_token']
+    account_settings = account.get('settings', {})
     
-    results = {}
+    print(f"Processing account for platform: {platform}, account_id: {account['id']}, token length: {len(access_token) if access_token else 0}")
     
-    print(f"Processing {len(accounts_data)} accounts in send_test_post_to_all_platforms")
-    for account in accounts_data:
-        try:
-            platform = account['platform']
-            access_token = account['access_token']
-            settings = account.get('settings', {})
+    if platform == 'vk':
+        vk_client = get_vk_client(access_token)
+        
+        # Проверяем, что обязательные настройки заданы
+        if not account_settings.get('group_id'):
+            error_msg = "Не указан ID группы/пользователя для VK"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        attachments = []
+        if post_data.get('media'):
+            # Обработка медиафайлов для VK
+            print(f"Processing {len(post_data['media'])} media files for VK")
+            # Скачиваем все медиафайлы поста параллельно, дальше они берутся из кэша
+            prefetch_media(post_data['media'])
+            photo_paths = []
+            for media_url in post_data['media']:
+                downloaded_path = fetch_media(media_url)
+                if downloaded_path:
+                    photo_paths.append(downloaded_path)
+                else:
+                    print(f"Failed to download media: {media_url}")
+            # Загружаем в VK все фото разом
+            attachments = vk_client.upload_photos(photo_paths, account_settings.get('group_id'))
+            print(f"Uploaded {len(attachments)} attachment(s) to VK")
+        
+        print(f"Sending post to VK with message: {post_data['content'][:50]}... and {len(attachments)} attachments")
+        result = vk_client.post_to_wall(
+            owner_id=str(account_settings.get('group_id')),
+            message=post_data['content'],
+            attachments=attachments if attachments else None
+        )
+        
+        if 'error' in result:
+            print(f"VK post failed: {result['error']}")
+            return {"success": False, "error": result['error']}
+        else:
+            print(f"VK post successful: {result}")
+            return {"success": True, "result": result}
+        
+    elif platform == 'telegram':
+        telegram_client = get_telegram_client(access_token)
+        
+        # Проверяем, что обязательные настройки заданы
+        if not account_settings.get('channel'):
+            error_msg = "Не указан канал для Telegram"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        print(f"Sending post to Telegram with message: {post_data['content'][:50]}... and {len(post_data.get('media', []))} media files")
+        result = run_async(
+            telegram_client.post_to_channel(
+                chat_id=str(account_settings.get('channel')),
+                text=post_data['content'],
+                media=post_data.get('media'),
+                progress_key=key
+            )
+        )
+        
+        if 'error' in result:
+            print(f"Telegram post failed: {result['error']}")
+            return {"success": False, "error": result['error'], "retryable": result.get('retryable', True)}
+        else:
+            print(f"Telegram post successful: {result}")
+            return {"success": True, "result": result}
+        
+    elif platform == 'instagram':
+        # Для Instagram access_token содержит логин:пароль
+        credentials = access_token.split(':')
+        if len(credentials) < 2:
+            error_msg = "Неверный формат учетных данных для Instagram (ожидается логин:пароль)"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        instagram_client = get_instagram_client(
+            username=credentials[0],
+            password=credentials[1]
+        )
+        
+        # Проверяем тип медиа и вызываем соответствующий метод
+        if post_data.get('media'):
+            media_url = post_data['media'][0]  # берем первое медиа
+            print(f"Sending post to Instagram with media: {media_url}")
             
-            print(f"Processing account for platform: {platform}, account_id: {account['id']}, token length: {len(access_token) if access_token else 0}")
+            # Скачиваем медиафайл для Instagram
+            downloaded_path = fetch_media(media_url)
             
-            if platform == 'vk':
-                vk_client = VKClient(access_token)
-                
-                # Проверяем, что обязательные настройки заданы
-                if not settings.get('group_id'):
-                    error_msg = "Не указан ID группы/пользователя для VK"
-                    print(error_msg)
-                    results[f"vk_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                attachments = []
-                if post_data.get('media'):
-                    # Обработка медиафайлов для VK
-                    print(f"Processing {len(post_data['media'])} media files for VK")
-                    for media_url in post_data['media']:
-                        print(f"Downloading media for VK: {media_url}")
-                        # Скачиваем и загружаем медиа в VK
-                        file_extension = get_file_extension(media_url)
-                        temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-                        
-                        downloaded_path = download_media(media_url, temp_filename)
-                        if downloaded_path:
-                            print(f"Downloaded media to: {downloaded_path}")
-                            # Загружаем в VK
-                            attachment = vk_client.upload_photo(downloaded_path, settings.get('group_id'))
-                            if attachment:
-                                print(f"Uploaded attachment to VK: {attachment}")
-                                attachments.append(attachment)
-                        else:
-                            print(f"Failed to download media: {media_url}")
-                
-                print(f"Sending post to VK with message: {post_data['content'][:50]}... and {len(attachments)} attachments")
-                result = vk_client.post_to_wall(
-                    owner_id=str(settings.get('group_id')),
-                    message=post_data['content'],
-                    attachments=attachments if attachments else None
-                )
-                
-                if 'error' in result:
-                    print(f"VK post failed: {result['error']}")
-                    results[f"vk_{account['id']}"] = {"success": False, "error": result['error']}
-                else:
-                    print(f"VK post successful: {result}")
-                    results[f"vk_{account['id']}"] = {"success": True, "result": result}
-                
-            elif platform == 'telegram':
-                telegram_client = TelegramClient(access_token)
-                
-                # Проверяем, что обязательные настройки заданы
-                if not settings.get('channel'):
-                    error_msg = "Не указан канал для Telegram"
-                    print(error_msg)
-                    results[f"telegram_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                print(f"Sending post to Telegram with message: {post_data['content'][:50]}... and {len(post_data.get('media', []))} media files")
-                result = run_async(
-                    telegram_client.post_to_channel(
-                        chat_id=str(settings.get('channel')),
-                        text=post_data['content'],
-                        media=post_data.get('media')
-                    )
-                )
-                
-                if 'error' in result:
-                    print(f"Telegram post failed: {result['error']}")
-                    results[f"telegram_{account['id']}"] = {"success": False, "error": result['error']}
-                else:
-                    print(f"Telegram post successful: {result}")
-                    results[f"telegram_{account['id']}"] = {"success": True, "result": result}
-                
-            elif platform == 'instagram':
-                # Для Instagram access_token содержит логин:пароль
-                credentials = access_token.split(':')
-                if len(credentials) < 2:
-                    error_msg = "Неверный формат учетных данных для Instagram (ожидается логин:пароль)"
-                    print(error_msg)
-                    results[f"instagram_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                instagram_client = InstagramClient(
-                    username=credentials[0],
-                    password=credentials[1]
-                )
-                
-                # Проверяем тип медиа и вызываем соответствующий метод
-                if post_data.get('media'):
-                    from app.utils.media_downloader import download_media, get_file_extension
-                    
-                    media_url = post_data['media'][0]  # берем первое медиа
-                    print(f"Sending post to Instagram with media: {media_url}")
-                    
-                    # Скачиваем медиафайл для Instagram
-                    file_extension = get_file_extension(media_url)
-                    temp_filename = f"/tmp/{uuid.uuid4()}.{file_extension}"
-                    downloaded_path = download_media(media_url, temp_filename)
-                    
-                    if not downloaded_path:
-                        error_msg = "Не удалось скачать медиафайл для Instagram"
-                        print(error_msg)
-                        results[f"instagram_{account['id']}"] = {"success": False, "error": error_msg}
-                        continue
-                    
-                    print(f"Downloaded media to: {downloaded_path}")
-                    
-                    if media_url.endswith(('.mp4', '.mov', '.avi')):
-                        # Это видео
-                        result = instagram_client.post_video(
-                            video_path=downloaded_path,
-                            caption=post_data['content']
-                        )
-                    else:
-                        # Это фото
-                        result = instagram_client.post_photo(
-                            photo_path=downloaded_path,
-                            caption=post_data['content']
-                        )
-                else:
-                    # Без медиа не можем опубликовать в Instagram
-                    error_msg = "Instagram требует медиафайл для публикации"
-                    print(error_msg)
-                    results[f"instagram_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                if 'error' in result:
-                    print(f"Instagram post failed: {result['error']}")
-                    results[f"instagram_{account['id']}"] = {"success": False, "error": result['error']}
-                else:
-                    print(f"Instagram post successful: {result}")
-                    results[f"instagram_{account['id']}"] = {"success": True, "result": result}
-                
-            elif platform == 'pinterest':
-                pinterest_client = PinterestClient(access_token)
-                
-                # Проверяем, что обязательные настройки заданы
-                if not settings.get('board'):
-                    error_msg = "Не указана доска для Pinterest"
-                    print(error_msg)
-                    results[f"pinterest_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                media_url = post_data.get('media', [None])[0] if post_data.get('media') else None
-                if not media_url:
-                    error_msg = "Pinterest требует медиафайл для публикации"
-                    print(error_msg)
-                    results[f"pinterest_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                print(f"Sending pin to Pinterest with title: {post_data['content'][:50]}...")
-                result = pinterest_client.create_pin(
-                    board_id=str(settings.get('board')),
-                    title=post_data['content'][:100],  # Заголовок ограничен 100 символами
-                    description=post_data['content'],
-                    image_url=media_url
+            if not downloaded_path:
+                error_msg = "Не удалось скачать медиафайл для Instagram"
+                print(error_msg)
+                return {"success": False, "error": error_msg}
+            
+            print(f"Downloaded media to: {downloaded_path}")
+            
+            if media_url.endswith(('.mp4', '.mov', '.avi')):
+                # Это видео
+                result = instagram_client.post_video(
+                    video_path=downloaded_path,
+                    caption=post_data['content']
                 )
-                
-                if 'error' in result:
-                    print(f"Pinterest post failed: {result['error']}")
-                    results[f"pinterest_{account['id']}"] = {"success": False, "error": result['error']}
-                else:
-                    print(f"Pinterest post successful: {result}")
-                    results[f"pinterest_{account['id']}"] = {"success": True, "result": result}
-                
-            elif platform == 'youtube':
-                youtube_client = YouTubeClient(access_token)
-                
-                media_path = post_data.get('media', [None])[0] if post_data.get('media') else None
-                if not media_path:
-                    error_msg = "YouTube требует медиафайл для публикации"
-                    print(error_msg)
-                    results[f"youtube_{account['id']}"] = {"success": False, "error": error_msg}
-                    continue
-                
-                print(f"Uploading short to YouTube with title: {post_data['content'][:50]}...")
-                result = youtube_client.upload_short(
-                    video_path=media_path,
-                    title=f"Тестовый пост: {post_data['content'][:50]}...",
-                    description=post_data['content']
+            else:
+                # Это фото
+                result = instagram_client.post_photo(
+                    photo_path=downloaded_path,
+                    caption=post_data['content']
                 )
-                
-                if 'error' in result:
-                    print(f"YouTube upload failed: {result['error']}")
-                    results[f"youtube_{account['id']}"] = {"success": False, "error": result['error']}
-                else:
-                    print(f"YouTube upload successful: {result}")
-                    results[f"youtube_{account['id']}"] = {"success": True, "result": result}
-                
+        else:
+            # Без медиа не можем опубликовать в Instagram
+            error_msg = "Instagram требует медиафайл для публикации"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        if 'error' in result:
+            print(f"Instagram post failed: {result['error']}")
+            return {"success": False, "error": result['error'], "retryable": result.get('retryable', True)}
+        else:
+            print(f"Instagram post successful: {result}")
+            return {"success": True, "result": result}
+        
+    elif platform == 'pinterest':
+        pinterest_client = get_pinterest_client(access_token)
+        
+        # Проверяем, что обязательные настройки заданы
+        if not account_settings.get('board'):
+            error_msg = "Не указана доска для Pinterest"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        media_url = post_data.get('media', [None])[0] if post_data.get('media') else None
+        if not media_url:
+            error_msg = "Pinterest требует медиафайл для публикации"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        
+        print(f"Sending pin to Pinterest with title: {post_data['content'][:50]}...")
+        result = pinterest_client.create_pin(
+            board_id=str(account_settings.get('board')),
+            title=post_data['content'][:100],  # Заголовок ограничен 100 символами
+            description=post_data['content'],
+            image_url=media_url
+        )
+        
+        if 'error' in result:
+            print(f"Pinterest post failed: {result['error']}")
+            return {"success": False, "error": result['error']}
+        else:
+            print(f"Pinterest post successful: {result}")
+            return {"success": True, "result": result}
+        
+    elif platform == 'youtube':
+        youtube_client = get_youtube_client(access_token)
+        
+        media_path = post_data.get('media', [None])[0] if post_data.get('media') else None
+        if not media_path:
+            error_msg = "YouTube требует медиафайл для публикации"
+            print(error_msg)
+            return {"success": False, "error": error_msg, "retryable": False}
+        if media_path.startswith(('http://', 'https://')):
+            media_path = fetch_media(media_path)
+            if not media_path:
+                return {"success": False, "error": "Не удалось скачать видео для YouTube"}
+        
+        print(f"Uploading short to YouTube with title: {post_data['content'][:50]}...")
+        # Ключ загрузки привязан к публикации: повтор задачи после падения воркера
+        # продолжает ту же resumable-сессию
+        result = youtube_client.upload_short(
+            video_path=media_path,
+            title=f"Тестовый пост: {post_data['content'][:50]}...",
+            description=post_data['content'],
+            upload_key=key,
+            on_progress=on_progress
+        )
+        
+        if 'error' in result:
+            print(f"YouTube upload failed: {result['error']}")
+            return {"success": False, "error": result['error'], "retryable": result.get('retryable', True)}
+        else:
+            print(f"YouTube upload successful: {result}")
+            return {"success": True, "result": result}
+    
+    return {"success": False, "error": f"Платформа {platform} не поддерживается", "retryable": False}
+
+def _target_post_id(result: dict) -> Optional[str]:
+    """ID опубликованного поста из ответа клиента платформы"""
+    published = result.get('result')
+    if not isinstance(published, dict):
+        return None
+    for field in ('post_id', 'message_id', 'video_id', 'media_id', 'id'):
+        if published.get(field) is not None:
+            return str(published[field])
+    return None
+
+@celery_app.task(bind=True, max_retries=settings.publish_max_retries)
+def send_post_to_account(self, post_data: dict, account: dict):
+    """Опубликовать пост в одном аккаунте (подзадача рассылки)"""
+    platform = account.get('platform', 'unknown')
+    target = f"{platform}_{account['id']}"
+    delivery_id = account.get('delivery_id')
+    
+    def report_progress(sent: int, total: int):
+        # Прогресс загрузки виден через AsyncResult(task_id).info
+        self.update_state(state='PROGRESS', meta={'target': target, 'sent': sent, 'total': total})
+    
+    def publish():
+        if delivery_id:
+            mark_delivery_started(delivery_id)
+        try:
+            result = _publish_to_account(post_data, account, key, on_progress=report_progress)
         except Exception as e:
             import traceback
-            platform = account.get('platform', 'unknown')
             error_message = str(e) if str(e) != "None" else "Неизвестная ошибка"
             print(f"Exception occurred while processing {platform} account {account['id']}: {error_message}")
             print(traceback.format_exc())
-            results[f"{platform}_{account['id']}"] = {"success": False, "error": error_message}
+            result = {"success": False, "error": error_message}
+        if delivery_id and not result.get('success'):
+            mark_delivery_retrying(delivery_id, result['error'])
+        return result
     
-    print(f"Completed send_test_post_to_all_platforms with results: {results}")
-    return {"status": "complete", "results": results}
+    try:
+        key = publish_key(post_data, target)
+    except ValueError as e:
+        result = {"success": False, "error": str(e)}
+    else:
+        result = _publish_once(self, key, publish)
+    
+    if delivery_id:
+        try:
+            mark_delivery_finished(
+                delivery_id, bool(result.get('success')), _target_post_id(result), result.get('error')
+            )
+        except Exception as e:
+            print(f"Error finishing delivery {delivery_id}: {e}")
+    return {target: result}
 
 @celery_app.task
-def repost_to_telegram(post_data: dict, bot_token: str, chat_id: str):
-    """Репостить контент в Telegram"""
+def collect_broadcast_results(results: list):
+    """Собрать результаты подзадач рассылки в один ответ"""
+    merged = {}
+    for result in results:
+        merged.update(result)
+    
+    print(f"Completed send_test_post_to_all_platforms with results: {merged}")
+    return {"status": "complete", "results": merged}
+
+@celery_app.task
+def send_test_post_to_all_platforms(post_data: dict, accounts_data: list):
+    """
+    Отправить тестовый пост во все подключенные платформы.
+    
+    Каждый аккаунт обрабатывается отдельной подзадачей, поэтому медленная загрузка
+    в одну платформу не задерживает остальные, а падение одной подзадачи не теряет
+    всю рассылку. Итог собирает collect_broadcast_results.
+    """
+    print(f"Starting send_test_post_to_all_platforms with post_data: {post_data}")
+    print(f"Accounts data: {len(accounts_data)} accounts")
+    
+    if not accounts_data:
+        return {"status": "complete", "results": {}}
+    
+    # Ключ идемпотентности подзадач: повторы и переотправка из очереди недоставленных
+    # не публикуют пост в аккаунт второй раз
+    post_data = {
+        **post_data,
+        'source_key': post_data.get('source_key') or source_key('crossposter', 'broadcast', uuid.uuid4())
+    }
+    
+    broadcast = chord(
+        group(send_post_to_account.s(post_data, account) for account in accounts_data),
+        collect_broadcast_results.s()
+    )()
+    
+    return {"status": "dispatched", "result_id": broadcast.id}
+
+@celery_app.task(bind=True, max_retries=settings.publish_max_retries)
+def repost_to_telegram(self, post_data: dict, bot_token: str, chat_id: str):
+    """Репостить контент в Telegram (post_data['source_key'] — источник поста, см. source_key)"""
     try:
-        telegram_client = TelegramClient(bot_token)
+        key = publish_key(post_data, f"telegram:{chat_id}")
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    
+    def publish():
+        telegram_client = get_telegram_client(bot_token)
         result = run_async(
-            telegram_client.post_to_channel(chat_id, post_data['text'], post_data.get('media'))
+            telegram_client.post_to_channel(chat_id, post_data['text'], post_data.get('media'), progress_key=key)
         )
-        
-        return {"status": "success", "result": result}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        if 'error' in result:
+            return {"success": False, "error": result['error']}
+        return {"success": True, "result": result}
+    
+    result = _publish_once(self, key, publish)
+    if result.get('success'):
+        return {"status": "success", "result": result['result']}
+    return {"status": "error", "message": result['error']}
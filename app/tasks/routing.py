@@ -0,0 +1,117 @@
+from typing import Dict, Optional
+from kombu import Queue
+from app.core.config import settings
+from app.utils.media_downloader import is_video_file
+
+# Очереди по классу нагрузки. Каждую обслуживает свой профиль воркеров, поэтому
+# долгие загрузки видео не занимают воркеры, публикующие короткие посты.
+QUEUE_POLLING = "polling"  # Опрос источников и приём новых постов
+QUEUE_TEXT = "publish_text"  # Публикации без медиа и служебные задачи рассылки
+QUEUE_MEDIA = "publish_media"  # Публикации с фото
+QUEUE_VIDEO = "publish_video"  # Публикации с видео и загрузки в YouTube
+
+ALL_QUEUES = (QUEUE_POLLING, QUEUE_TEXT, QUEUE_MEDIA, QUEUE_VIDEO)
+
+# Профили воркеров: какие очереди слушать и как забирать задачи.
+# prefetch 1 и acks_late у публикаций — чтобы длинная задача не держала за собой
+# очередь из уже полученных воркером задач, а задача упавшего воркера вернулась в очередь.
+WORKER_PROFILES: Dict[str, Dict] = {
+    "polling": {
+        "queues": [QUEUE_POLLING],
+        "concurrency": 8,
+        "prefetch_multiplier": 4,
+        "acks_late": False,
+    },
+    "text": {
+        "queues": [QUEUE_TEXT],
+        "concurrency": 8,
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+    },
+    "media": {
+        "queues": [QUEUE_MEDIA],
+        "concurrency": 4,
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+    },
+    "video": {
+        "queues": [QUEUE_VIDEO],
+        "concurrency": 2,
+        "prefetch_multiplier": 1,
+        "acks_late": True,
+    },
+}
+
+# Задачи, очередь которых не зависит от аргументов
+_STATIC_ROUTES = {
+    "app.tasks.monitoring.check_vk_posts": QUEUE_POLLING,
+    "app.tasks.monitoring.check_vk_posts_batch": QUEUE_POLLING,
+    "app.tasks.monitoring.ingest_vk_posts": QUEUE_POLLING,
+    "app.tasks.monitoring.check_telegram_posts": QUEUE_POLLING,
+    "app.tasks.monitoring.ingest_telegram_chat": QUEUE_POLLING,
+    "app.tasks.monitoring.check_instagram_posts": QUEUE_POLLING,
+    "app.tasks.monitoring.send_test_post_to_all_platforms": QUEUE_TEXT,
+    "app.tasks.monitoring.collect_broadcast_results": QUEUE_TEXT,
+}
+
+# Публикации: очередь выбирается по медиа поста (первый аргумент — post_data)
+_PUBLISH_TASKS = {
+    "app.tasks.monitoring.repost_to_vk",
+    "app.tasks.monitoring.repost_to_telegram",
+    "app.tasks.monitoring.send_post_to_account",
+}
+
+
+def publish_queue(post_data: Dict, platform: Optional[str] = None) -> str:
+    """Очередь для публикации поста по его медиа и целевой платформе"""
+    media = post_data.get('media') or []
+    if platform == 'youtube' or any(is_video_file(str(item).split('?')[0]) for item in media):
+        return QUEUE_VIDEO
+    if media:
+        return QUEUE_MEDIA
+    return QUEUE_TEXT
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Маршрутизатор Celery (task_routes): единственное место, где задачам назначаются очереди"""
+    if name in _STATIC_ROUTES:
+        return {"queue": _STATIC_ROUTES[name]}
+
+    if name in _PUBLISH_TASKS:
+        args, kwargs = list(args or []), kwargs or {}
+        post_data = kwargs.get('post_data') or (args[0] if args else {}) or {}
+        account = kwargs.get('account') or (args[1] if len(args) > 1 else None)
+        platform = account.get('platform') if isinstance(account, dict) else None
+        return {"queue": publish_queue(post_data, platform)}
+
+    return None
+
+
+def worker_profile_config(profile: str) -> Dict:
+    """Настройки Celery для воркера заданного профиля"""
+    if profile not in WORKER_PROFILES:
+        raise ValueError(f"Неизвестный профиль воркера: {profile} (доступны: {', '.join(WORKER_PROFILES)})")
+
+    worker_profile = WORKER_PROFILES[profile]
+    return {
+        "task_queues": [Queue(queue) for queue in worker_profile["queues"]],
+        "worker_concurrency": worker_profile["concurrency"],
+        "worker_prefetch_multiplier": worker_profile["prefetch_multiplier"],
+        "task_acks_late": worker_profile["acks_late"],
+        # Задачу воркера, убитого посреди выполнения, возвращаем в очередь
+        "task_reject_on_worker_lost": worker_profile["acks_late"],
+    }
+
+
+def celery_config() -> Dict:
+    """Общие настройки маршрутизации для всех процессов (веб, планировщик, воркеры)"""
+    return {
+        "task_queues": [Queue(queue) for queue in ALL_QUEUES],
+        "task_default_queue": QUEUE_TEXT,
+        "task_routes": (route_task,),
+        # С acks_late задача остаётся неподтверждённой до конца выполнения; без этого брокер
+        # через час (значение по умолчанию) отдал бы ещё идущую загрузку видео второму воркеру.
+        # Значение общее для всех процессов: восстанавливает задачи любой из них
+        "broker_transport_options": {"visibility_timeout": settings.celery_visibility_timeout_seconds},
+    }
+
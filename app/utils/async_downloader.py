@@ -0,0 +1,95 @@
+import asyncio
+import os
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from app.core.config import settings
+from app.utils.media_downloader import CHUNK_SIZE
+
+
+class AsyncMediaDownloader:
+    """
+    Асинхронный загрузчик медиафайлов с общим пулом соединений.
+
+    Соединения (keep-alive) переиспользуются между файлами, общее число соединений
+    и число одновременных загрузок с одного хоста ограничены. Сессия aiohttp привязана
+    к event loop, поэтому при вызове из другого loop она создаётся заново.
+    """
+
+    def __init__(self, limit: int = None, limit_per_host: int = None):
+        self.limit = limit or settings.media_download_concurrency
+        self.limit_per_host = limit_per_host or settings.media_download_concurrency_per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+            )
+            self._loop = loop
+            self._host_semaphores = {}
+        return self._session
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).hostname or ''
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.limit_per_host)
+        return self._host_semaphores[host]
+
+    async def download(self, url: str, save_path: str, max_bytes: Optional[int] = None) -> Optional[str]:
+        """Скачать файл потоково на диск; при ошибке или превышении размера вернуть None"""
+        max_bytes = max_bytes or settings.media_max_download_bytes
+        part_path = f"{save_path}.part"
+        session = await self._get_session()
+
+        try:
+            async with self._host_semaphore(url):
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    if response.content_length and response.content_length > max_bytes:
+                        print(f"Error downloading media: {url} is larger than {max_bytes} bytes")
+                        return None
+
+                    written = 0
+                    with open(part_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            written += len(chunk)
+                            if written > max_bytes:
+                                print(f"Error downloading media: {url} is larger than {max_bytes} bytes")
+                                break
+                            f.write(chunk)
+
+            if written > max_bytes:
+                os.unlink(part_path)
+                return None
+
+            os.replace(part_path, save_path)
+            return save_path
+        except Exception as e:
+            print(f"Error downloading media: {e}")
+            try:
+                os.unlink(part_path)
+            except OSError:
+                pass
+            return None
+
+    async def download_many(self, targets: Dict[str, str]) -> Dict[str, Optional[str]]:
+        """
+        Скачать несколько файлов параллельно.
+        targets — URL -> путь сохранения; возвращает URL -> путь или None при ошибке.
+        """
+        urls = list(targets)
+        paths = await asyncio.gather(*[self.download(url, targets[url]) for url in urls])
+        return dict(zip(urls, paths))
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+# Общий загрузчик процесса
+async_downloader = AsyncMediaDownloader()
@@ -0,0 +1,94 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Optional
+from app.core.config import settings
+
+
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    """Новый event loop (uvloop, если он установлен и включён в настройках)"""
+    if settings.async_loop_use_uvloop:
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            pass
+    return asyncio.new_event_loop()
+
+
+class BackgroundEventLoop:
+    """
+    Долгоживущий event loop процесса в отдельном потоке.
+
+    Синхронный код (задачи Celery, обработчики админки) отправляет в него корутины
+    через submit/run. Loop не закрывается между вызовами, поэтому async-клиенты
+    (пул соединений httpx у python-telegram-bot, сессия aiohttp загрузчика медиа)
+    держат соединения открытыми от задачи к задаче. Loop запускается при первом
+    вызове; в дочернем процессе после fork (воркеры Celery) создаётся свой.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Поток loop не переживает fork — в дочернем процессе запускаем новый
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        loop = self._loop
+        if loop is not None:
+            return loop
+
+        with self._lock:
+            if self._loop is None:
+                loop = _new_event_loop()
+                thread = threading.Thread(
+                    target=self._run, args=(loop,), name="crossposter-event-loop", daemon=True
+                )
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Запустить корутину в фоновом loop и вернуть concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Выполнить корутину в фоновом loop и дождаться результата"""
+        if self._thread is threading.current_thread():
+            coro.close()
+            raise RuntimeError("run_async нельзя вызывать из фонового event loop — используйте await")
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout: float = 5):
+        """Остановить loop (при завершении процесса)"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+
+# Общий фоновый loop процесса
+background_loop = BackgroundEventLoop()
+
+
+def run_async(coro, timeout: Optional[float] = None):
+    """Выполнить async функцию из синхронного кода в фоновом loop процесса"""
+    return background_loop.run(coro, timeout)
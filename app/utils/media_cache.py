@@ -0,0 +1,282 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.utils.media_downloader import download_media, get_file_extension
+
+# Общий кэш медиафайлов на хосте:
+#   blobs/<sha256 содержимого>.<ext> — сами файлы (одинаковое содержимое хранится один раз)
+#   urls/<sha256 URL>                — символическая ссылка на blob, её mtime — время скачивания
+#   locks/                           — файловые блокировки, чтобы один URL качал один воркер
+#   tmp/                             — файлы, которые скачиваются или перекодируются прямо сейчас
+#   probes/<sha256 содержимого>.json — метаданные видео (media_transcoder)
+#
+# Служебные файлы, не использованные дольше media_cache_ttl_seconds, удаляет _prune.
+
+# Как часто (не чаще) удалять устаревшие служебные файлы кэша
+_PRUNE_INTERVAL_SECONDS = 600
+
+
+def _cache_path(*parts: str) -> str:
+    return os.path.join(settings.media_cache_dir, *parts)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """Посчитать SHA-256 содержимого файла, не читая его в память целиком"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def media_content_hash(path: str) -> str:
+    """Хэш содержимого медиафайла (для файлов из кэша берётся из имени без пересчёта)"""
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(_cache_path('blobs')):
+        return os.path.basename(path).split('.', 1)[0]
+    return file_sha256(path)
+
+
+@contextmanager
+def _file_lock(name: str, blocking: bool = True):
+    """Межпроцессная блокировка на файле; при blocking=False отдаёт False, если занята"""
+    os.makedirs(_cache_path('locks'), exist_ok=True)
+    lock_path = _cache_path('locks', f"{name}.lock")
+    while True:
+        with open(lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                current = os.stat(lock_path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(lock_file.fileno()).st_ino:
+                # Пока ждали, файл блокировки удалила очистка (_prune) — берём новый
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                continue
+            os.utime(lock_path)
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return
+
+
+def _lookup(url_link: str) -> Optional[str]:
+    """Найти свежую запись кэша по ссылке URL; отметить использование blob для LRU"""
+    try:
+        age = time.time() - os.lstat(url_link).st_mtime
+        blob_path = os.path.realpath(url_link)
+        if age > settings.media_cache_ttl_seconds or not os.path.exists(blob_path):
+            return None
+        os.utime(blob_path)
+        return blob_path
+    except OSError:
+        return None
+
+
+def _evict():
+    """Удалить давно не использованные blob'ы, пока кэш не уложится в лимит размера"""
+    with _file_lock('evict', blocking=False) as acquired:
+        if not acquired:
+            return  # Очисткой уже занимается другой процесс
+
+        blobs_dir = _cache_path('blobs')
+        entries = []
+        for name in os.listdir(blobs_dir):
+            try:
+                stat = os.stat(os.path.join(blobs_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= settings.media_cache_max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(blobs_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+        _prune()
+
+
+def _prune():
+    """
+    Удалить устаревшие служебные файлы: ссылки URL на удалённые или устаревшие blob'ы,
+    давно не использованные блокировки и метаданные, брошенные временные файлы
+    (например, .part от упавших загрузок). Выполняется не чаще _PRUNE_INTERVAL_SECONDS.
+    """
+    marker = _cache_path('pruned')
+    now = time.time()
+    try:
+        if now - os.stat(marker).st_mtime < _PRUNE_INTERVAL_SECONDS:
+            return
+    except FileNotFoundError:
+        pass
+    open(marker, 'a').close()
+    os.utime(marker)
+
+    stale_before = now - settings.media_cache_ttl_seconds
+
+    def stale_entries(directory: str):
+        path = _cache_path(directory)
+        if not os.path.isdir(path):
+            return
+        for name in os.listdir(path):
+            entry = os.path.join(path, name)
+            try:
+                if os.lstat(entry).st_mtime < stale_before or (directory == 'urls' and not os.path.exists(entry)):
+                    yield name, entry
+            except OSError:
+                continue
+
+    for directory in ('urls', 'tmp', 'probes'):
+        for _, entry in list(stale_entries(directory)):
+            try:
+                os.unlink(entry)
+            except OSError:
+                pass
+
+    for name, entry in list(stale_entries('locks')):
+        # Удаляем только свободные блокировки; ждущие её процессы заметят подмену файла
+        with _file_lock(name[:-len('.lock')], blocking=False) as acquired:
+            if acquired:
+                try:
+                    os.unlink(entry)
+                except OSError:
+                    pass
+
+
+def _store(url: str, temp_path: str) -> str:
+    """Перенести скачанный файл в кэш и привязать к нему URL"""
+    extension = get_file_extension(url)
+    blob_path = _cache_path('blobs', f"{file_sha256(temp_path)}.{extension}")
+    if os.path.exists(blob_path):
+        os.unlink(temp_path)
+        os.utime(blob_path)
+    else:
+        os.replace(temp_path, blob_path)
+
+    # Ссылка подменяется атомарно, чтобы читатели не увидели её отсутствующей
+    temp_link = _cache_path('tmp', f"{uuid.uuid4()}.link")
+    os.symlink(blob_path, temp_link)
+    os.replace(temp_link, _cache_path('urls', _sha256(url.encode())))
+    return blob_path
+
+
+def _ensure_dirs():
+    for directory in ('blobs', 'urls', 'tmp'):
+        os.makedirs(_cache_path(directory), exist_ok=True)
+
+
+def cached_media(url: str) -> Optional[str]:
+    """Путь к файлу URL, если он уже есть в кэше (без скачивания)"""
+    return _lookup(_cache_path('urls', _sha256(url.encode())))
+
+
+def fetch_media(url: str) -> Optional[str]:
+    """
+    Получить путь к локальной копии медиафайла по URL.
+
+    Файл скачивается один раз на хост и переиспользуется всеми задачами и воркерами,
+    пока не истечёт media_cache_ttl_seconds. Возвращённый файл принадлежит кэшу —
+    удалять его нельзя. При ошибке скачивания возвращает None.
+    """
+    url_key = _sha256(url.encode())
+    url_link = _cache_path('urls', url_key)
+
+    blob_path = _lookup(url_link)
+    if blob_path:
+        return blob_path
+
+    _ensure_dirs()
+
+    with _file_lock(url_key):
+        # Пока ждали блокировку, файл мог скачать другой воркер
+        blob_path = _lookup(url_link)
+        if blob_path:
+            return blob_path
+
+        extension = get_file_extension(url)
+        temp_path = _cache_path('tmp', f"{uuid.uuid4()}.{extension}")
+        if not download_media(url, temp_path):
+            return None
+
+        blob_path = _store(url, temp_path)
+
+    _evict()
+    return blob_path
+
+
+async def prefetch_media_async(urls: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Заполнить кэш сразу всеми медиафайлами поста (или нескольких постов).
+
+    Отсутствующие в кэше файлы скачиваются параллельно через общий пул соединений,
+    поэтому пост с несколькими фото скачивается за время самого медленного файла.
+    Как и в fetch_media, URL качает только воркер, взявший его блокировку; URL, которые
+    уже качает другой воркер, дожидаются его через fetch_media.
+    Возвращает URL -> путь в кэше (None, если скачать не удалось).
+    """
+    from app.utils.async_downloader import async_downloader
+
+    urls = [url for url in dict.fromkeys(urls) if url and url.startswith(('http://', 'https://'))]
+    result = {url: _lookup(_cache_path('urls', _sha256(url.encode()))) for url in urls}
+
+    missing = [url for url, path in result.items() if not path]
+    if not missing:
+        return result
+
+    _ensure_dirs()
+    busy = []
+    with ExitStack() as stack:
+        targets = {}
+        for url in missing:
+            url_key = _sha256(url.encode())
+            if not stack.enter_context(_file_lock(url_key, blocking=False)):
+                busy.append(url)
+                continue
+            # Пока проверяли кэш, файл мог скачать другой воркер
+            result[url] = _lookup(_cache_path('urls', url_key))
+            if not result[url]:
+                targets[url] = _cache_path('tmp', f"{uuid.uuid4()}.{get_file_extension(url)}")
+
+        if targets:
+            downloaded = await async_downloader.download_many(targets)
+            for url, temp_path in downloaded.items():
+                if temp_path:
+                    result[url] = _store(url, temp_path)
+
+    # Чужие загрузки ждём только после снятия своих блокировок, иначе два воркера,
+    # взявшие блокировки друг у друга, ждали бы друг друга бесконечно
+    if busy:
+        paths = await asyncio.gather(*[asyncio.to_thread(fetch_media, url) for url in busy])
+        result.update(zip(busy, paths))
+
+    _evict()
+    return result
+
+
+def prefetch_media(urls: List[str]) -> Dict[str, Optional[str]]:
+    """Синхронная обёртка над prefetch_media_async для задач Celery"""
+    from app.utils.async_loop import run_async
+
+    if not urls:
+        return {}
+    # Выполняется в фоновом loop процесса — соединения загрузчика остаются открытыми
+    return run_async(prefetch_media_async(urls))
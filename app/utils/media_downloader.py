@@ -1,29 +1,88 @@
 import requests
 import os
 from typing import Optional
+from app.core.config import settings
 
 
-def download_media(url: str, save_path: str) -> Optional[str]:
-    """Скачать медиафайл по URL и сохранить по указанному пути"""
+# Размер буфера при потоковом скачивании
+CHUNK_SIZE = 256 * 1024
+
+
+def _remove(path: str):
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-
-        # Создание директории, если она не существует
-        # os.path.dirname возвращает пустую строку для имён без пути —
-        # в этом случае makedirs вызывать не нужно
-        dir_name = os.path.dirname(save_path)
-        if dir_name:
-            os.makedirs(dir_name, exist_ok=True)
-
-        # Сохранение файла
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
-
-        return save_path
-    except Exception as e:
-        print(f"Error downloading media: {e}")
-        return None
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def download_media(url: str, save_path: str, max_bytes: Optional[int] = None) -> Optional[str]:
+    """
+    Скачать медиафайл по URL и сохранить по указанному пути.
+
+    Файл пишется на диск потоково, в памяти держится только буфер CHUNK_SIZE.
+    Файлы больше max_bytes (по умолчанию media_max_download_bytes) отклоняются —
+    по заголовку Content-Length ещё до скачивания, иначе по мере чтения.
+    Оборванная передача продолжается с места обрыва запросом Range, если сервер
+    его поддерживает. Пока файл не скачан полностью, он лежит рядом с суффиксом .part.
+    """
+    max_bytes = max_bytes or settings.media_max_download_bytes
+    part_path = f"{save_path}.part"
+
+    # Создание директории, если она не существует
+    # os.path.dirname возвращает пустую строку для имён без пути —
+    # в этом случае makedirs вызывать не нужно
+    dir_name = os.path.dirname(save_path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+
+    for attempt in range(settings.media_download_retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        try:
+            with requests.get(url, stream=True, timeout=30, headers=headers) as response:
+                if response.status_code == 416:
+                    # Сервер не принял диапазон — начинаем заново
+                    _remove(part_path)
+                    continue
+                response.raise_for_status()
+
+                if offset and response.status_code != 206:
+                    # Сервер не поддерживает Range и отдаёт файл целиком
+                    offset = 0
+
+                content_length = response.headers.get('Content-Length')
+                if content_length and offset + int(content_length) > max_bytes:
+                    print(f"Error downloading media: {url} is larger than {max_bytes} bytes")
+                    _remove(part_path)
+                    return None
+
+                written = offset
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            print(f"Error downloading media: {url} is larger than {max_bytes} bytes")
+                            break
+                        f.write(chunk)
+
+                if written > max_bytes:
+                    _remove(part_path)
+                    return None
+
+            os.replace(part_path, save_path)
+            return save_path
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            # Обрыв связи — следующая попытка продолжит с уже скачанной части
+            print(f"Download of {url} interrupted (attempt {attempt + 1}): {e}")
+        except Exception as e:
+            print(f"Error downloading media: {e}")
+            _remove(part_path)
+            return None
+
+    print(f"Error downloading media: {url} failed after {settings.media_download_retries + 1} attempts")
+    _remove(part_path)
+    return None
 
 
 def get_file_extension(url: str) -> str:
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+from app.core.config import settings
+from app.utils.media_cache import _cache_path, _evict, _file_lock, media_content_hash
+
+# Требования платформ к видео. Варианты кэшируются по отпечатку параметров профиля,
+# а не по имени платформы, поэтому платформы с одинаковыми требованиями делят одну
+# перекодированную копию. При изменении параметров меняется отпечаток, и старые
+# варианты просто вытесняются из кэша.
+#   max_duration  — длительность, секунды. Более длинные видео отклоняются, а при
+#                   media_transcode_trim_overlength обрезаются до этой длительности
+#   max_long_side — максимальная длинная сторона кадра, пиксели
+#   max_fps       — максимальная частота кадров
+#   max_bytes     — лимит размера файла: битрейт варианта рассчитывается так, чтобы в него уложиться
+#   crf, video_maxrate — качество и верхняя граница битрейта H.264 (бит/с)
+VIDEO_PROFILES: Dict[str, Dict] = {
+    "youtube": {
+        "max_duration": 180,  # Shorts — до 3 минут
+        "max_long_side": 1920,
+        "max_fps": 60,
+        "max_bytes": None,
+        "crf": 21,
+        "video_maxrate": 12_000_000,
+        "audio_bitrate": 192_000,
+    },
+    "instagram": {
+        "max_duration": 60,  # Видео в ленте через video_upload
+        "max_long_side": 1920,
+        "max_fps": 30,
+        "max_bytes": 100 * 1024 ** 2,
+        "crf": 23,
+        "video_maxrate": 5_000_000,
+        "audio_bitrate": 128_000,
+    },
+    "telegram": {
+        "max_duration": None,
+        "max_long_side": 1280,
+        "max_fps": 30,
+        "max_bytes": 50 * 1024 ** 2,  # Лимит загрузки файла ботом
+        "crf": 26,
+        "video_maxrate": 2_500_000,
+        "audio_bitrate": 128_000,
+    },
+}
+
+# Ниже этого битрейта видео в лимит размера уже не уложить с приемлемым качеством
+_MIN_VIDEO_BITRATE = 200_000
+# Запас на контейнер и неточность ограничения битрейта
+_SIZE_HEADROOM = 0.9
+
+# Общие для всех профилей требования: MP4 с H.264/AAC, yuv420p, индекс в начале файла
+_CONTAINERS = ('mp4', 'mov')
+_VIDEO_CODEC = 'h264'
+_AUDIO_CODEC = 'aac'
+_PIXEL_FORMAT = 'yuv420p'
+
+
+class VideoRejected(Exception):
+    """Видео нельзя привести к требованиям платформы (слишком длинное или не уложится в размер)"""
+
+
+def _profile_fingerprint(profile: Dict) -> str:
+    return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """Частота кадров из строки ffprobe вида '30000/1001'"""
+    try:
+        numerator, _, denominator = (rate or '').partition('/')
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _run(command, timeout: int) -> subprocess.CompletedProcess:
+    return subprocess.run(command, capture_output=True, text=True, timeout=timeout, check=True)
+
+
+def probe_media(path: str) -> Optional[Dict]:
+    """
+    Метаданные видео через ffprobe: длительность, разрешение, кодеки, частота кадров, размер.
+
+    Результат сохраняется рядом с кэшем медиа по хэшу содержимого, поэтому каждый файл
+    анализируется один раз на хост. При ошибке ffprobe возвращает None.
+    """
+    content_hash = media_content_hash(path)
+    probe_path = _cache_path('probes', f"{content_hash}.json")
+    try:
+        with open(probe_path) as f:
+            metadata = json.load(f)
+        os.utime(probe_path)  # Используемые метаданные не удаляются очисткой кэша
+        return metadata
+    except (OSError, ValueError):
+        pass
+
+    try:
+        output = _run(
+            [settings.ffprobe_path, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+            timeout=60
+        ).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Error probing media {path}: {e}")
+        return None
+
+    data = json.loads(output)
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    media_format = data.get('format', {})
+    metadata = {
+        'content_hash': content_hash,
+        'format': media_format.get('format_name'),
+        'duration': float(media_format.get('duration') or video.get('duration') or 0),
+        'size': int(media_format.get('size') or os.path.getsize(path)),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'video_codec': video.get('codec_name'),
+        'pixel_format': video.get('pix_fmt'),
+        'fps': _parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+        'audio_codec': audio.get('codec_name'),
+    }
+
+    os.makedirs(_cache_path('probes'), exist_ok=True)
+    temp_path = _cache_path('probes', f"{uuid.uuid4()}.tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(temp_path, probe_path)
+    return metadata
+
+
+def _fits_profile(metadata: Dict, profile: Dict) -> bool:
+    """Подходит ли видео под профиль без перекодирования"""
+    formats = (metadata.get('format') or '').split(',')
+    if not any(container in formats for container in _CONTAINERS):
+        return False
+    if metadata.get('video_codec') != _VIDEO_CODEC or metadata.get('pixel_format') != _PIXEL_FORMAT:
+        return False
+    if metadata.get('audio_codec') not in (None, _AUDIO_CODEC):
+        return False
+    if max(metadata.get('width') or 0, metadata.get('height') or 0) > profile['max_long_side']:
+        return False
+    if profile['max_duration'] and metadata['duration'] > profile['max_duration']:
+        return False
+    if metadata.get('fps') and metadata['fps'] > profile['max_fps'] + 0.5:
+        return False
+    if profile['max_bytes'] and metadata['size'] > profile['max_bytes']:
+        return False
+    return True
+
+
+def _video_bitrate(metadata: Dict, profile: Dict, platform: str) -> int:
+    """Верхняя граница битрейта видео: профиль, а при лимите размера — не больше, чем в него влезает"""
+    bitrate = profile['video_maxrate']
+    if profile['max_bytes']:
+        duration = min(metadata['duration'], profile['max_duration'] or metadata['duration'])
+        if duration > 0:
+            budget = int(profile['max_bytes'] * 8 * _SIZE_HEADROOM / duration) - profile['audio_bitrate']
+            if budget < _MIN_VIDEO_BITRATE:
+                raise VideoRejected(
+                    f"Видео длительностью {duration:.0f} с не уложится в лимит {platform} "
+                    f"{profile['max_bytes'] // 1024 ** 2} МБ"
+                )
+            bitrate = min(bitrate, budget)
+    return bitrate
+
+
+def _ffmpeg_command(source: str, target: str, metadata: Dict, profile: Dict, video_bitrate: int):
+    long_side = profile['max_long_side']
+    # Длинная сторона не больше max_long_side, вторая — с сохранением пропорций; обе чётные
+    if (metadata.get('width') or 0) >= (metadata.get('height') or 0):
+        scale = f"scale='trunc(min({long_side},iw)/2)*2':-2"
+    else:
+        scale = f"scale=-2:'trunc(min({long_side},ih)/2)*2'"
+    filters = [scale]
+    if metadata.get('fps') and metadata['fps'] > profile['max_fps'] + 0.5:
+        filters.append(f"fps={profile['max_fps']}")
+
+    command = [settings.ffmpeg_path, '-y', '-v', 'error', '-i', source]
+    if profile['max_duration'] and metadata['duration'] > profile['max_duration']:
+        # Сюда попадаем, только если обрезка разрешена (media_transcode_trim_overlength)
+        command += ['-t', str(profile['max_duration'])]
+    command += [
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', ','.join(filters),
+        '-c:v', 'libx264', '-preset', settings.media_transcode_preset, '-crf', str(profile['crf']),
+        '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate),
+        '-pix_fmt', _PIXEL_FORMAT,
+        '-c:a', 'aac', '-b:a', str(profile['audio_bitrate']), '-ar', '44100',
+        '-movflags', '+faststart',
+        '-f', 'mp4', target,
+    ]
+    return command
+
+
+@contextmanager
+def _transcode_slot():
+    """
+    Занять один из media_transcode_concurrency слотов перекодирования на хосте.
+
+    Слоты — файловые блокировки, поэтому ограничение общее для всех процессов воркеров
+    (пулы процессов внутри демонических процессов Celery создавать нельзя).
+    """
+    while True:
+        for slot in range(settings.media_transcode_concurrency):
+            with _file_lock(f"transcode-slot-{slot}", blocking=False) as acquired:
+                if acquired:
+                    yield
+                    return
+        time.sleep(0.5)
+
+
+def prepare_video(path: str, platform: str) -> str:
+    """
+    Подготовить видео под требования платформы.
+
+    Если видео уже подходит под профиль платформы, возвращается исходный путь. Иначе
+    возвращается путь к варианту в кэше медиа: вариант строится из хэша исходного файла
+    и отпечатка профиля, перекодируется один раз на хост (параллельные задачи ждут
+    готовый файл) и переиспользуется всеми задачами, пока не будет вытеснен из кэша.
+    Файл варианта принадлежит кэшу — удалять его нельзя.
+
+    Видео длиннее max_duration профиля отклоняется (VideoRejected), если обрезка не
+    разрешена настройкой media_transcode_trim_overlength. VideoRejected выбрасывается и
+    тогда, когда видео не укладывается в лимит размера платформы даже после перекодирования.
+    Если ffmpeg недоступен или перекодирование не удалось, возвращается исходный путь.
+    """
+    profile = VIDEO_PROFILES.get(platform)
+    if not settings.media_transcode_enabled or not profile or not os.path.isfile(path):
+        return path
+
+    metadata = probe_media(path)
+    if not metadata or not metadata.get('video_codec') or _fits_profile(metadata, profile):
+        return path
+
+    if (profile['max_duration'] and metadata['duration'] > profile['max_duration']
+            and not settings.media_transcode_trim_overlength):
+        raise VideoRejected(
+            f"Видео длится {metadata['duration']:.0f} с, {platform} принимает не больше {profile['max_duration']} с"
+        )
+    video_bitrate = _video_bitrate(metadata, profile, platform)
+
+    variant_key = hashlib.sha256(f"{metadata['content_hash']}:{_profile_fingerprint(profile)}".encode()).hexdigest()
+    variant_path = _cache_path('blobs', f"{variant_key}.mp4")
+    if os.path.exists(variant_path):
+        os.utime(variant_path)
+        return variant_path
+
+    os.makedirs(_cache_path('blobs'), exist_ok=True)
+    os.makedirs(_cache_path('tmp'), exist_ok=True)
+    with _file_lock(f"transcode-{variant_key}"):
+        # Пока ждали блокировку, вариант мог перекодировать другой воркер
+        if os.path.exists(variant_path):
+            return variant_path
+
+        temp_path = _cache_path('tmp', f"{uuid.uuid4()}.mp4")
+        started = time.monotonic()
+        try:
+            with _transcode_slot():
+                _run(
+                    _ffmpeg_command(path, temp_path, metadata, profile, video_bitrate),
+                    timeout=settings.media_transcode_timeout_seconds
+                )
+        except (OSError, subprocess.SubprocessError) as e:
+            stderr = getattr(e, 'stderr', None)
+            print(f"Error transcoding {path} for {platform}: {stderr.strip() if stderr else e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return path
+
+        size = os.path.getsize(temp_path)
+        if profile['max_bytes'] and size > profile['max_bytes']:
+            os.unlink(temp_path)
+            raise VideoRejected(
+                f"Перекодированное видео ({size // 1024 ** 2} МБ) не укладывается в лимит {platform} "
+                f"{profile['max_bytes'] // 1024 ** 2} МБ"
+            )
+
+        os.replace(temp_path, variant_path)
+        print(f"Transcoded {path} for {platform} in {time.monotonic() - started:.1f}s")
+
+    _evict()
+    return variant_path
+
+
+async def prepare_video_async(path: str, platform: str) -> str:
+    """prepare_video в отдельном потоке, не блокируя event loop"""
+    return await asyncio.to_thread(prepare_video, path, platform)
@@ -1,5 +1,13 @@
+import os
 from app.tasks.monitoring import celery_app
+from app.tasks.routing import worker_profile_config
 from app.core.config import settings
 
+# Профиль воркера (polling, text, media, video) задаёт, какие очереди он слушает,
+# с какой параллельностью и как подтверждает задачи. Без профиля воркер слушает все очереди.
+worker_profile = os.getenv("CELERY_WORKER_PROFILE")
+if worker_profile:
+    celery_app.conf.update(**worker_profile_config(worker_profile))
+
 if __name__ == "__main__":
     celery_app.start()
\ No newline at end of file
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Telegram для проверки вебхука: отправляет записанные обновления
+(JSON-массив или по одному JSON-объекту на строку) на /api/v1/webhooks/telegram/<bot_id>
+
+Пример:
+    python replay_telegram_updates.py updates.json --bot-id 123456 --secret my_secret
+"""
+import argparse
+import json
+import requests
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправить записанные обновления Telegram на вебхук")
+    parser.add_argument('updates_file')
+    parser.add_argument('--bot-id', required=True)
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    args = parser.parse_args()
+
+    url = f"{args.base_url.rstrip('/')}/api/v1/webhooks/telegram/{args.bot_id}"
+    for update in load_updates(args.updates_file):
+        response = requests.post(
+            url,
+            json=update,
+            headers={'X-Telegram-Bot-Api-Secret-Token': args.secret},
+            timeout=10
+        )
+        print(f"update_id={update.get('update_id')}: {response.status_code} {response.text}")
+
+
+if __name__ == "__main__":
+    main()